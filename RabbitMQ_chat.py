@@ -6,17 +6,20 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 root_dir = os.path.dirname(current_dir)
 # 将项目根目录添加到系统路径
 sys.path.append(root_dir)
-import httpx
 import asyncio
 import aio_pika
 import json
-from app.config.settings import token_limit_default, chat_count_limit_default
+import signal
 import logging
-from app.models.models import Task, TaskStatus, File as FileModel, TokenUsage
+from app.models.models import Task, TaskStatus, File as FileModel
 from app.models.database import async_get_db
 from sqlalchemy import update, select
-from datetime import date
 from app.services.history_messages import chat_flow
+from app.services.fair_scheduler import FairScheduler
+from app.services.metrics import metrics, serve_metrics
+from app.services.quota import quota
+from app.services.callback_dispatcher import callback_dispatcher
+from app.services.queue_publisher import declare_task_queue
 
 # 配置日志
 logging.basicConfig(
@@ -25,90 +28,92 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 单个 worker 同时处理的消息数；预取窗口至少与之相等，默认留出余量供调度器在用户之间轮询
+CHAT_CONCURRENCY = int(os.getenv("CHAT_CONCURRENCY", "8"))
+CHAT_SCHEDULER_PREFETCH = max(int(os.getenv("CHAT_SCHEDULER_PREFETCH", str(CHAT_CONCURRENCY * 4))), CHAT_CONCURRENCY)
+# 收到 SIGTERM 后等待处理中消息完成的秒数，超时的消息退回队列
+CHAT_SHUTDOWN_TIMEOUT = float(os.getenv("CHAT_SHUTDOWN_TIMEOUT", "60"))
+scheduler = FairScheduler()
+# 处理中的任务 -> 消息
+in_flight = {}
+# 指标旁路端口，0 表示不开启
+CHAT_METRICS_PORT = int(os.getenv("CHAT_METRICS_PORT", "9101"))
 
-async def chat_token(username: str, chat_url:str, chat_count = 10):
-    today = date.today()
-    async with async_get_db() as db:
-        result = await db.execute(select(TokenUsage).where(TokenUsage.user_id == username))
-        usage = result.scalars().first()
-        if usage is None:
-            new_record = TokenUsage(
-                user_id=username
-            )
-            db.add(new_record)
-            await db.commit()
-            return True
-        elif usage.expiration_date < today:
-            usage.expiration_date = today
-            usage.task_input_tokens = 0
-            usage.task_output_tokens = 0
-            usage.chat_count = 0
-            usage.chat_count_limit = chat_count_limit_default
-            usage.token_limit = token_limit_default
-            await db.commit()
-            return True
-        elif usage.chat_count < usage.chat_count_limit:
-            return True
-        else:
-            async with httpx.AsyncClient() as client:
-                content = {
-                    "answer": "今日聊天次数已达上限，欢迎明日继续使用 ！"
-                }
-                content1 = {
-                    "end": True
-                }
-                try:
-                    await client.post(chat_url, json=content)
-                    response = await client.post(chat_url, json=content1)
-                    response.raise_for_status()
-                except httpx.HTTPStatusError as e:
-                    logger.error(f"HTTP状态错误，请求 {chat_url} 时，内容: {content}, 错误: {e}")
-                except httpx.RequestError as e:
-                    logger.error(f"请求错误，请求 {chat_url} 时，内容: {content}, 错误: {e}")
-                return False
+metrics.register_collector("chat_scheduler", scheduler.snapshot, label="tenant")
+metrics.register_collector("chat_quota", quota.snapshot)
+metrics.register_collector("chat_callback", callback_dispatcher.snapshot)
+metrics.register_collector("chat_consumer", lambda: {
+    "in_flight": len(in_flight),
+    "queued": len(scheduler),
+    "concurrency": CHAT_CONCURRENCY,
+})
 
 
+async def chat_token(db, username: str, chat_url:str, session_task_id: str):
+    """
+    预留一次当日聊天次数，由 quota 的条件 UPDATE 原子地判断上限并惰性完成跨天重置
 
+    次数已用尽时通知前端并返回 False；预留随调用方的事务提交
 
+    :param session_task_id: 聊天会话 ID，同一会话的回调按顺序发送
+    """
+    if await quota.reserve_chat(db, username):
+        return True
+    # 通知前端由回调分发器在后台发送，不阻塞当前消息的处理
+    callback_dispatcher.send(chat_url, {"answer": "今日聊天次数已达上限，欢迎明日继续使用 ！"}, session_task_id)
+    callback_dispatcher.send(chat_url, {"end": True}, session_task_id)
+    return False
 
-async def process_file_content(
-        task_id,
-        session_task_id,
-        user_id: str,
-        file_path: str,
-        task_type: str,
-        username: str,
-):
-    async with async_get_db() as db:
-        try:
-            file_result = await db.execute(
-                select(FileModel).where(FileModel.session_task_id == session_task_id)
-            )
-            file1 = file_result.scalar_one_or_none()
-            can_chat = await chat_token(username, file1.callback_chat_url)
-            if can_chat:
-                final_result = await chat_flow(
-                    session_task_id,
-                    file_path,
-                    file1.callback_chat_url,
-                    user_id
-                )
-                status = TaskStatus.FAILED if final_result is None else TaskStatus.COMPLETED
-                result = '失败' if final_result is None else '成功'
-                await update_task_status(db, Task, task_id, status, result=result)
-                # 修改TokenUsage表
-                await db.execute(
-                    update(TokenUsage)
-                    .where(TokenUsage.user_id == username)
-                    .values(chat_count=TokenUsage.chat_count + 1)
-                )
-                await db.commit()
 
-        except Exception as e:
-            logger.error(f'聊天异常: {str(e)}')
-            await update_task_status(db, Task, task_id, TaskStatus.FAILED, result=json.dumps({"error": str(e)}))
+async def process_file_content(db, task, file1, user_id: str, file_path: str):
+    """
+    在 message_handler 的会话中处理一条聊天任务
+
+    聊天次数的预留与任务标记为处理中在同一次提交中写入；预留提交后聊天异常时退还次数，
+    提交本身失败时预留已随回滚撤销，不再退还。提交后 ORM 对象会过期，需要的字段先取出。
+    退出时被 drain 取消的任务消息已退回队列：同样退还次数，并把状态改回待处理后继续抛出取消。
+    """
+    task_id = task.id
+    session_task_id = task.session_task_id
+    username = task.user_id
+    chat_url = file1.callback_chat_url
+    reserved = False
+    committed = False
+    try:
+        can_chat = reserved = await chat_token(db, username, chat_url, session_task_id)
+        # 更新任务状态为处理中
+        task.status = TaskStatus.PROCESSING
+        await db.commit()
+        committed = True
+        if can_chat:
+            final_result = await chat_flow(
+                session_task_id,
+                file_path,
+                chat_url,
+                user_id
+            )
+            status = TaskStatus.FAILED if final_result is None else TaskStatus.COMPLETED
+            result = '失败' if final_result is None else '成功'
+            reserved = False
+            await update_task_status(db, Task, task_id, status, result=result)
             await db.commit()
 
+    except asyncio.CancelledError:
+        logger.warning(f'聊天任务 {task_id} 被取消，等待重新投递')
+        await db.rollback()
+        if reserved and committed:
+            await quota.release_chat(db, username)
+        await update_task_status(db, Task, task_id, TaskStatus.PENDING)
+        await db.commit()
+        raise
+    except Exception as e:
+        logger.error(f'聊天异常: {str(e)}')
+        await db.rollback()
+        if reserved and committed:
+            await quota.release_chat(db, username)
+        await update_task_status(db, Task, task_id, TaskStatus.FAILED, result=json.dumps({"error": str(e)}))
+        await db.commit()
+
 
 async def update_task_status(db, model, id, status, result=None):
     """更新任务状态的辅助函数"""
@@ -128,28 +133,31 @@ async def message_handler(message: aio_pika.IncomingMessage):
     """单条消息处理逻辑"""
     async with message.process(requeue=False):  # 失败时自动重新入队
         async with async_get_db() as db:
+            task_id = None
             try:
                 payload = json.loads(message.body.decode())
                 task_id = payload["task_id"]
                 user_id = payload["user_id"]
                 file_path = payload["file_path"]
 
-                # 异步获取任务（推荐使用 get 方法）
-                task = await db.get(Task, task_id)
-                file_result = await db.execute(select(FileModel).where(FileModel.session_task_id == task.session_task_id))
-                file = file_result.scalar_one_or_none()
-                if not task or not file:
+                # Task 与 File 一次联表查出，后续读写都在这个会话中完成
+                row = (await db.execute(
+                    select(Task, FileModel)
+                    .join(FileModel, FileModel.session_task_id == Task.session_task_id)
+                    .where(Task.id == task_id)
+                    .limit(1)
+                )).first()
+                if row is None:
                     logger.warning(f"任务 {task_id}或文件数据不存在")
                     return
-                # 更新任务状态为处理中
-                task.status = TaskStatus.PROCESSING
-                await db.commit()
-                await process_file_content(task.id, task.session_task_id, user_id, file_path, task.task_type, task.user_id)
+                task, file = row
+                await process_file_content(db, task, file, user_id, file_path)
             except Exception as e:
                 logger.error(f"消息处理异常: {str(e)}")
                 try:
-                    if task:  # 确保task存在
+                    if task_id is not None:
                         # 统一处理任务失败
+                        await db.rollback()
                         await update_task_status(db, Task, task_id, TaskStatus.FAILED, result=json.dumps({"error": str(e)}))
                         await db.commit()
                 except Exception as db_e:
@@ -162,6 +170,80 @@ async def message_handler(message: aio_pika.IncomingMessage):
 
 
 
+async def schedule_message(message: aio_pika.IncomingMessage):
+    """消费回调只把消息按用户放入调度器，由 dispatch_messages 取出处理"""
+    try:
+        tenant = json.loads(message.body.decode()).get("user_id", "")
+    except Exception:
+        tenant = ""
+    scheduler.put(tenant, message, message.priority or 0)
+
+
+async def handle_message(message: aio_pika.IncomingMessage):
+    metrics.inc("chat_messages_total")
+    with metrics.timer("message", name="chat_stage_seconds"):
+        await message_handler(message)
+
+
+async def dispatch_messages(stopping: asyncio.Event):
+    """按调度器给出的顺序处理消息，同时处理的消息数不超过 CHAT_CONCURRENCY，stopping 置位后停止取新消息"""
+    slots = asyncio.Semaphore(CHAT_CONCURRENCY)
+
+    def finished(task):
+        in_flight.pop(task, None)
+        slots.release()
+
+    stop = asyncio.create_task(stopping.wait())
+    try:
+        while True:
+            # 名额全部占用时同样要响应退出信号，否则要等某条聊天结束后才能开始 drain
+            acquire = asyncio.create_task(slots.acquire())
+            await asyncio.wait({acquire, stop}, return_when=asyncio.FIRST_COMPLETED)
+            if not acquire.done():
+                acquire.cancel()
+                return
+            if stopping.is_set():
+                slots.release()
+                return
+            get = asyncio.create_task(scheduler.get())
+            await asyncio.wait({get, stop}, return_when=asyncio.FIRST_COMPLETED)
+            if not get.done():
+                # 等待中取消不会从调度器取出消息
+                get.cancel()
+                slots.release()
+                return
+            tenant, message = get.result()
+            task = asyncio.create_task(handle_message(message))
+            in_flight[task] = message
+            task.add_done_callback(finished)
+    finally:
+        stop.cancel()
+
+
+async def drain(queue, consumer_tag):
+    """
+    停止消费并退出：调度器中未开始的消息退回队列，处理中的消息等待完成，
+    超过 CHAT_SHUTDOWN_TIMEOUT 仍未完成的退回队列后取消
+    """
+    await queue.cancel(consumer_tag)
+    requeued = 0
+    while len(scheduler):
+        tenant, message = scheduler.get_nowait()
+        await message.nack(requeue=True)
+        requeued += 1
+    pending = set(in_flight)
+    if pending:
+        done, pending = await asyncio.wait(pending, timeout=CHAT_SHUTDOWN_TIMEOUT)
+    for task in pending:
+        try:
+            await in_flight[task].nack(requeue=True)
+            requeued += 1
+        except Exception as e:
+            logger.error(f"消息退回队列失败: {e}")
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    logger.info(f"消费者已停止，退回队列 {requeued} 条消息")
+
 
 async def run_consumer():
     try:
@@ -172,18 +254,29 @@ async def run_consumer():
 
         # 创建通道
         channel = await connection.channel()
-        # 声明队列，并持久化
-        queue = await channel.declare_queue("chat_tasks", durable=True)
+        # 声明队列，并持久化；队列带 x-max-priority，broker 按消息优先级投递
+        queue = await declare_task_queue(channel, "chat_tasks")
+
+        # 设置QoS，预取一个窗口的消息供调度器在用户之间轮询，并发处理 CHAT_CONCURRENCY 条
+        await channel.set_qos(prefetch_count=CHAT_SCHEDULER_PREFETCH)
+
+        # SIGTERM/SIGINT 时停止取新消息，处理完或退回处理中的消息后退出
+        stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stopping.set)
 
-        # 设置QoS，限制消费者一次只处理一个消息
-        await channel.set_qos(prefetch_count=1)
+        if CHAT_METRICS_PORT:
+            metrics_server = await serve_metrics(CHAT_METRICS_PORT)
+            logger.info(f"指标服务监听端口 {CHAT_METRICS_PORT}")
 
         logger.info(' [*] 等待消息中...')
 
         # 开始消费
-        await queue.consume(message_handler)
-        # 保持协程运行
-        await asyncio.Event().wait()
+        consumer_tag = await queue.consume(schedule_message)
+        # 保持协程运行，直到收到退出信号
+        await dispatch_messages(stopping)
+        await drain(queue, consumer_tag)
 
     except asyncio.CancelledError:
         logger.info("消费者任务被取消")
@@ -191,6 +284,10 @@ async def run_consumer():
         logger.error(f"消费者发生错误: {e}")
     finally:
         # 确保资源被正确关闭
+        if 'metrics_server' in locals():
+            metrics_server.close()
+        # 发送完已排队的回调再退出
+        await callback_dispatcher.close(CHAT_SHUTDOWN_TIMEOUT)
         if 'connection' in locals() and connection:
             await connection.close()
 
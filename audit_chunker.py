@@ -0,0 +1,111 @@
+import os
+import re
+
+# 每个审计块的 token 预算（估算值，不含提示词）以及相邻块重叠的行数
+CHUNK_TOKEN_BUDGET = int(os.getenv("CHUNK_TOKEN_BUDGET", "25000"))
+CHUNK_OVERLAP_LINES = int(os.getenv("CHUNK_OVERLAP_LINES", "0"))
+# 单行超过预算时（压缩后的 js 等）按字符切分的长度，约等于预算对应的字符数
+MAX_CHUNK_CHARS = CHUNK_TOKEN_BUDGET * 4
+# 每行 "行号: " 前缀的估算 token 数
+LINE_PREFIX_TOKENS = 2
+# 预留 token 额度时每块额外计入的提示词模板与本地检测结果、以及模型输出的估算 token 数
+CHUNK_PROMPT_TOKENS = int(os.getenv("CHUNK_PROMPT_TOKENS", "1500"))
+CHUNK_OUTPUT_TOKENS = int(os.getenv("CHUNK_OUTPUT_TOKENS", "3000"))
+
+# 顶格书写的函数、类等声明，优先在这些行之前切分
+_DECLARATION = re.compile(
+    r"^(?:async\s+def|def|class|func|function|fn|sub|pub|public|private|protected|internal|static|"
+    r"export|impl|struct|enum|interface|trait|module|package|namespace|template|@\w+)\b"
+)
+_BLOCK_END = {"}", "};", "end"}
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：ASCII 约 4 个字符一个 token，中文等字符约一个字符一个 token"""
+    ascii_count = len(text.encode("ascii", "ignore"))
+    return ascii_count // 4 + (len(text) - ascii_count) + 1
+
+
+def is_boundary(lines, i: int) -> bool:
+    """第 i 行之前是否适合切分：顶格声明，或紧跟在顶格的块结束行之后"""
+    line = lines[i]
+    if not line or line[0].isspace():
+        return False
+    if _DECLARATION.match(line):
+        return True
+    return i > 0 and lines[i - 1].rstrip() in _BLOCK_END
+
+
+def split_lines(lines, budget: int = CHUNK_TOKEN_BUDGET, overlap: int = CHUNK_OVERLAP_LINES):
+    """
+    按行切分文件，使每块的估算 token 数不超过预算
+
+    块内已用满一半预算后，优先在函数、类边界处切分；否则在预算用尽的行切分。
+    单行超过预算时独占一块。
+
+    :param lines: 源码行（不含行号前缀）
+    :return: [(起始行下标, 结束行下标)]，结束下标不含
+    """
+    ranges = []
+    count = len(lines)
+    start = 0
+    while start < count:
+        total = 0
+        end = start
+        boundary = None
+        while end < count:
+            cost = estimate_tokens(lines[end]) + LINE_PREFIX_TOKENS
+            if end > start and total + cost > budget:
+                break
+            if end > start and total >= budget // 2 and is_boundary(lines, end):
+                boundary = end
+            total += cost
+            end += 1
+        if end < count and boundary is not None:
+            end = boundary
+        ranges.append((start, end))
+        if end >= count:
+            break
+        start = max(end - overlap, start + 1)
+    return ranges
+
+
+def plan_chunks(lines, numbered_lines, budget: int = CHUNK_TOKEN_BUDGET, overlap: int = CHUNK_OVERLAP_LINES):
+    """
+    按 split_lines 的结果规划审计块，超长的单行再按字符切分；块文本由 render_chunk 按需生成
+
+    :param lines: 源码行序列，支持下标访问即可（如 LineIndex）
+    :param numbered_lines: 与 lines 对应的带行号的行序列
+    :return: [(起始行下标, 结束行下标, 字符区间)]，字符区间为 None 表示整块
+    """
+    chunks = []
+    for start, end in split_lines(lines, budget, overlap):
+        length = len(numbered_lines[start]) if end - start == 1 else 0
+        if length > MAX_CHUNK_CHARS:
+            chunks.extend((start, end, (i, i + MAX_CHUNK_CHARS)) for i in range(0, length, MAX_CHUNK_CHARS))
+        else:
+            chunks.append((start, end, None))
+    return chunks
+
+
+def estimate_chunk_tokens(lines, chunks) -> int:
+    """
+    估算审计 plan_chunks 规划的所有块消耗的 token 总数（输入与输出），用于审计前预留额度
+
+    :param lines: 与 plan_chunks 相同的源码行序列
+    """
+    total = 0
+    for start, end, piece in chunks:
+        if piece is None:
+            total += sum(estimate_tokens(lines[i]) + LINE_PREFIX_TOKENS for i in range(start, end))
+        else:
+            total += estimate_tokens(lines[start][piece[0]:piece[1]])
+        total += CHUNK_PROMPT_TOKENS + CHUNK_OUTPUT_TOKENS
+    return total
+
+
+def render_chunk(numbered_lines, start: int, end: int, piece=None) -> str:
+    """拼接 plan_chunks 规划的块文本"""
+    if piece is not None:
+        return numbered_lines[start][piece[0]:piece[1]]
+    return ''.join(numbered_lines[start:end])
@@ -0,0 +1,76 @@
+import sys
+import os
+# 获取当前脚本所在的目录
+current_dir = os.path.dirname(os.path.abspath(__file__))
+# 获取项目根目录
+root_dir = os.path.dirname(current_dir)
+# 将项目根目录添加到系统路径
+sys.path.append(root_dir)
+import random
+import timeit
+from app.services.output_parser import parse_line_lists, parse_type_dict
+
+
+def eval_line_lists(snippet):
+    """原 snippet_verification 的实现"""
+    snippet_true = []
+    for i in snippet:
+        try:
+            j = eval(i)
+            snippet_true.append([int(item) for item in j])
+        except:
+            snippet_true.append([])
+    return snippet_true
+
+
+def make_report(count: int):
+    rng = random.Random(0)
+    well_formed = []
+    sloppy = []
+    for _ in range(count):
+        lines = sorted(rng.sample(range(1, 2000), rng.randint(1, 6)))
+        well_formed.append(str(lines))
+        start = lines[0]
+        sloppy.append(rng.choice([
+            f"{start}-{start + rng.randint(1, 8)}",
+            "［" + "，".join(str(n) for n in lines) + "］",
+            f"第{start}行",
+            f"[{start}, ]",
+        ]))
+    types = {f"'一级标题{i}'": f"'二级标题{i}'" for i in range(count)}
+    type_text = "{" + ", ".join(f"{k}: {v}" for k, v in types.items()) + "}"
+    return well_formed, sloppy, type_text
+
+
+def bench(label, func, arg, repeat):
+    seconds = min(timeit.repeat(lambda: func(arg), number=repeat, repeat=3)) / repeat
+    print(f"{label:<32}{seconds * 1e6:>12.1f} us")
+
+
+def main():
+    """
+    模型输出解析的微基准：对比原先基于 eval 的解析与 output_parser
+
+    用法：python bench_output_parser.py [漏洞条数] [重复次数]
+    """
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    well_formed, sloppy, type_text = make_report(count)
+
+    print(f"{count} 条漏洞，每项重复 {repeat} 次")
+    bench("eval 行号（格式规范）", eval_line_lists, well_formed, repeat)
+    bench("parser 行号（格式规范）", parse_line_lists, well_formed, repeat)
+    bench("eval 行号（格式不规范）", eval_line_lists, sloppy, repeat)
+    bench("parser 行号（格式不规范）", parse_line_lists, sloppy, repeat)
+    bench("eval 分类字典", eval, type_text, repeat)
+    bench("parser 分类字典", parse_type_dict, type_text, repeat)
+
+    assert eval_line_lists(well_formed) == parse_line_lists(well_formed)
+    assert eval(type_text) == parse_type_dict(type_text)
+    recovered = sum(1 for lines in eval_line_lists(sloppy) if lines)
+    parsed = sum(1 for lines in parse_line_lists(sloppy) if lines)
+    print(f"格式不规范的行号：eval 解析出 {recovered}/{count} 条，parser 解析出 {parsed}/{count} 条")
+
+
+if __name__ == "__main__":
+    main()
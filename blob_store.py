@@ -0,0 +1,122 @@
+import logging
+import os
+from collections import OrderedDict
+
+import aiofiles
+
+from app.services.delivery_dedup import delivery_dedup, blob_audit_key
+
+logger = logging.getLogger(__name__)
+
+# 按 git blob SHA 缓存已下载的文件内容，超过容量后按最近最少使用淘汰
+BLOB_STORE_DIR = os.getenv("BLOB_STORE_DIR", os.path.join("file", ".blobs"))
+BLOB_STORE_MAX_BYTES = int(os.getenv("BLOB_STORE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+
+class BlobStore:
+    """
+    内容寻址的文件缓存
+
+    磁盘上每个 blob 存为 {root}/{sha[:2]}/{sha}，内存中维护 LRU 索引，进程重启后从磁盘重建。
+    已发布过审计任务的 (用户, blob, 路径) 记录在 webhook_deliveries 表中，重启后仍然有效，
+    并由所有 worker 共享；内容缓存被淘汰不影响审计记录。
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # sha -> 字节数
+        self._bytes = 0
+        self._loaded = False
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "skipped_downloads": 0,
+            "skipped_publishes": 0,
+            "evictions": 0,
+        }
+
+    def _path(self, sha: str) -> str:
+        return os.path.join(self.root, sha[:2], sha)
+
+    def _load_index(self):
+        """首次使用时按修改时间从磁盘重建 LRU 索引"""
+        self._loaded = True
+        if not os.path.isdir(self.root):
+            return
+        blobs = []
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                if name.endswith(".tmp"):
+                    continue
+                stat = os.stat(os.path.join(directory, name))
+                blobs.append((stat.st_mtime, name, stat.st_size))
+        for _, sha, size in sorted(blobs):
+            self._entries[sha] = size
+            self._bytes += size
+        self._evict()
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._entries:
+            sha, size = self._entries.popitem(last=False)
+            self._bytes -= size
+            self.stats["evictions"] += 1
+            try:
+                os.remove(self._path(sha))
+            except OSError as e:
+                logger.warning(f"blob 淘汰失败 {sha}: {e}")
+
+    async def was_audited(self, user_id: str, sha: str, path: str, downloaded: bool = True) -> bool:
+        """
+        该用户是否已为此路径上的这个 blob 发布过审计任务，命中时计入跳过统计
+
+        :param downloaded: 调用前是否已经下载了内容，未下载时同时计为跳过一次下载
+        """
+        seen, = await delivery_dedup.seen_many([blob_audit_key(user_id, sha, path)], "blob")
+        if seen:
+            self.stats["skipped_publishes"] += 1
+            if not downloaded:
+                self.stats["skipped_downloads"] += 1
+        return seen
+
+    async def get(self, sha: str):
+        """读取缓存的 blob 内容，不存在时返回 None"""
+        if not self._loaded:
+            self._load_index()
+        if sha not in self._entries:
+            self.stats["misses"] += 1
+            return None
+        try:
+            async with aiofiles.open(self._path(sha), mode="r", encoding="utf-8") as f:
+                content = await f.read()
+        except OSError:
+            self._bytes -= self._entries.pop(sha)
+            self.stats["misses"] += 1
+            return None
+        self._entries.move_to_end(sha)
+        self.stats["hits"] += 1
+        self.stats["skipped_downloads"] += 1
+        return content
+
+    async def put(self, sha: str, content: str):
+        if not self._loaded:
+            self._load_index()
+        if sha in self._entries:
+            self._entries.move_to_end(sha)
+            return
+        path = self._path(sha)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = content.encode("utf-8")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        async with aiofiles.open(tmp_path, mode="wb") as f:
+            await f.write(data)
+        os.replace(tmp_path, path)
+        self._entries[sha] = len(data)
+        self._bytes += len(data)
+        self._evict()
+
+    def snapshot(self):
+        return {**self.stats, "entries": len(self._entries), "bytes": self._bytes}
+
+
+blob_store = BlobStore(BLOB_STORE_DIR, BLOB_STORE_MAX_BYTES)
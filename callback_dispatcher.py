@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import os
+from collections import deque
+from urllib.parse import urlsplit
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# 相邻回答片段的合并窗口（秒）：窗口内到达的片段合并为一次 POST
+CALLBACK_COALESCE_WINDOW = float(os.getenv("CALLBACK_COALESCE_WINDOW", "0.05"))
+# 每个回调主机的连接池上限
+CALLBACK_MAX_PER_HOST = int(os.getenv("CALLBACK_MAX_PER_HOST", "10"))
+CALLBACK_KEEPALIVE_EXPIRY = float(os.getenv("CALLBACK_KEEPALIVE_EXPIRY", "30"))
+CALLBACK_TIMEOUT = float(os.getenv("CALLBACK_TIMEOUT", "10"))
+# 失败重试：从 base 秒起每次翻倍，最多 max 秒，共重试 retries 次
+CALLBACK_RETRIES = int(os.getenv("CALLBACK_RETRIES", "4"))
+CALLBACK_RETRY_BASE = float(os.getenv("CALLBACK_RETRY_BASE", "0.5"))
+CALLBACK_RETRY_MAX = float(os.getenv("CALLBACK_RETRY_MAX", "8"))
+# 所有会话待发送回调的总数上限，超出时丢弃新的回调，避免回调地址不可用时无限占用内存
+CALLBACK_MAX_PENDING = int(os.getenv("CALLBACK_MAX_PENDING", "10000"))
+
+
+def _is_fragment(payload) -> bool:
+    """只有 answer 一个字段的回答片段可以与相邻片段合并"""
+    return isinstance(payload, dict) and payload.keys() == {"answer"} and isinstance(payload["answer"], str)
+
+
+def _retryable(e: Exception) -> bool:
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code == 429 or e.response.status_code >= 500
+    return isinstance(e, httpx.RequestError)
+
+
+class CallbackDispatcher:
+    """
+    向前端回调地址发送消息的共享分发器
+
+    send() 只把消息放入会话的队列后立即返回，不会阻塞消费者协程；每个会话由一个后台任务
+    按顺序发送，窗口内相邻的回答片段合并为一次 POST。每个回调主机使用一个长连接客户端。
+    """
+
+    def __init__(self):
+        self._clients = {}  # 主机 -> httpx.AsyncClient
+        self._queues = {}  # 会话 -> deque[(url, payload)]
+        self._workers = {}  # 会话 -> asyncio.Task
+        self._pending = 0
+        self.stats = {
+            "sent": 0,
+            "coalesced": 0,
+            "retries": 0,
+            "failed": 0,
+            "dropped": 0,
+        }
+
+    def _client(self, url: str) -> httpx.AsyncClient:
+        parts = urlsplit(url)
+        host = (parts.scheme, parts.netloc)
+        client = self._clients.get(host)
+        if client is None:
+            limits = httpx.Limits(
+                max_connections=CALLBACK_MAX_PER_HOST,
+                max_keepalive_connections=CALLBACK_MAX_PER_HOST,
+                keepalive_expiry=CALLBACK_KEEPALIVE_EXPIRY,
+            )
+            client = self._clients[host] = httpx.AsyncClient(limits=limits, timeout=CALLBACK_TIMEOUT)
+        return client
+
+    def send(self, url: str, payload: dict, session: str):
+        """
+        把一条回调放入会话队列，立即返回
+
+        :param session: 保证顺序的会话标识（聊天会话 ID）；所有聊天共用同一个回调地址，
+            不能用地址代替，否则不同会话的回调会在同一个队列中串行发送
+        """
+        if not url:
+            return
+        if self._pending >= CALLBACK_MAX_PENDING:
+            self.stats["dropped"] += 1
+            logger.error(f"待发送回调已达上限 {CALLBACK_MAX_PENDING}，丢弃发往 {url} 的内容: {payload}")
+            return
+        self._queues.setdefault(session, deque()).append((url, payload))
+        self._pending += 1
+        if session not in self._workers:
+            self._workers[session] = asyncio.get_running_loop().create_task(self._run(session))
+
+    async def _run(self, session: str):
+        queue = self._queues[session]
+        try:
+            while queue:
+                if _is_fragment(queue[0][1]) and len(queue) == 1:
+                    # 给后续片段留出合并窗口
+                    await asyncio.sleep(CALLBACK_COALESCE_WINDOW)
+                url, payload = queue.popleft()
+                taken = 1
+                if _is_fragment(payload):
+                    parts = [payload["answer"]]
+                    while queue and queue[0][0] == url and _is_fragment(queue[0][1]):
+                        parts.append(queue.popleft()[1]["answer"])
+                    taken = len(parts)
+                    payload = {"answer": "".join(parts)}
+                    self.stats["coalesced"] += taken - 1
+                try:
+                    await self._post(url, payload)
+                finally:
+                    self._pending -= taken
+        finally:
+            self._pending -= len(queue)
+            del self._queues[session]
+            del self._workers[session]
+
+    async def _post(self, url: str, payload: dict):
+        client = self._client(url)
+        for attempt in range(CALLBACK_RETRIES + 1):
+            try:
+                response = await client.post(url, json=payload)
+                response.raise_for_status()
+                self.stats["sent"] += 1
+                return
+            except httpx.HTTPError as e:
+                if attempt == CALLBACK_RETRIES or not _retryable(e):
+                    self.stats["failed"] += 1
+                    logger.error(f"回调失败，请求 {url} 时，内容: {payload}, 错误: {e}")
+                    return
+                self.stats["retries"] += 1
+                await asyncio.sleep(min(CALLBACK_RETRY_BASE * 2 ** attempt, CALLBACK_RETRY_MAX))
+
+    async def close(self, timeout: float = None):
+        """等待已排队的回调发送完毕（超时后取消），然后关闭所有连接"""
+        workers = list(self._workers.values())
+        if workers:
+            done, pending = await asyncio.wait(workers, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                logger.warning(f"{len(pending)} 个会话的回调未在超时内发送完毕，已放弃")
+                await asyncio.gather(*pending, return_exceptions=True)
+        clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            await client.aclose()
+
+    def snapshot(self):
+        return {
+            **self.stats,
+            "pending": self._pending,
+            "sessions": len(self._workers),
+            "hosts": len(self._clients),
+        }
+
+
+callback_dispatcher = CallbackDispatcher()
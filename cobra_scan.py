@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import os
+import re
+from collections import OrderedDict
+
+from app.cobra.cobra import cobra
+from app.services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 按文件内容哈希缓存的 cobra 结果条数
+COBRA_CACHE_SIZE = int(os.getenv("COBRA_CACHE_SIZE", "1024"))
+
+# cobra 结果中表示行号的字段，取不到行号的结果视为作用于整个文件
+_LINE_KEYS = ("line_number", "line", "lines", "start_line", "行号")
+_NUMBER = re.compile(r"\d+")
+
+
+class CobraCache:
+    """文件内容哈希 -> cobra 结果的进程内 LRU 缓存"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, digest: str):
+        findings = self._entries.get(digest)
+        if findings is None:
+            self.stats["misses"] += 1
+            return None
+        self._entries.move_to_end(digest)
+        self.stats["hits"] += 1
+        return findings
+
+    def put(self, digest: str, findings):
+        self._entries[digest] = findings
+        self._entries.move_to_end(digest)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def snapshot(self):
+        return {**self.stats, "entries": len(self._entries)}
+
+
+cobra_cache = CobraCache(COBRA_CACHE_SIZE)
+
+
+def finding_rows(finding):
+    """
+    cobra 单条结果涉及的行号（待审计文件中的行，从 1 开始）
+
+    :return: (最小行号, 最大行号)，无法确定时返回 None
+    """
+    if not isinstance(finding, dict):
+        return None
+    for key in _LINE_KEYS:
+        if key in finding:
+            numbers = [int(n) for n in _NUMBER.findall(str(finding[key]))]
+            if numbers:
+                return min(numbers), max(numbers)
+    return None
+
+
+def findings_in(cobra_list, start: int, end: int):
+    """落在第 start+1 到 end 行之间的 cobra 结果，以及无法确定行号的结果"""
+    selected = []
+    for finding in cobra_list:
+        rows = finding_rows(finding)
+        if rows is None or (rows[0] <= end and rows[1] > start):
+            selected.append(finding)
+    return selected
+
+
+class CobraScan:
+    """
+    与读取文件并行运行的 cobra 扫描
+
+    创建时立即开始扫描；得到文件内容哈希后调用 use_content 查询缓存，命中则取消扫描。
+    """
+
+    def __init__(self, full_path: str):
+        self.full_path = full_path
+        self.digest = None
+        self._cached = None
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        try:
+            with metrics.timer("cobra"):
+                return await cobra(self.full_path)
+        except Exception as e:
+            metrics.inc("audit_cobra_failures_total", error=type(e).__name__)
+            logger.warning(f"cobra 扫描失败 {self.full_path}: {e}")
+            return None
+
+    def use_content(self, digest: str):
+        """:param digest: 文件内容的 sha256"""
+        self.digest = digest
+        self._cached = cobra_cache.get(self.digest)
+        if self._cached is not None:
+            self._task.cancel()
+
+    def done(self) -> bool:
+        return self._cached is not None or self._task.done()
+
+    async def result(self):
+        """扫描结果，扫描失败时返回空列表；多个块可以同时等待"""
+        if self._cached is not None:
+            return self._cached
+        findings = await asyncio.shield(self._task)
+        if findings is None:
+            return []
+        if self.digest is not None:
+            cobra_cache.put(self.digest, findings)
+        return findings
+
+    def cancel(self):
+        self._task.cancel()
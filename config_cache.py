@@ -0,0 +1,114 @@
+import logging
+import os
+import time
+from collections import OrderedDict
+
+import aio_pika
+from sqlalchemy import select
+
+from app.models.database import async_get_db
+from app.models.models import GitConfig
+
+logger = logging.getLogger(__name__)
+
+# webhook 鉴权所需的 git 配置在进程内缓存，配置变更时通过广播交换机通知所有进程失效
+GIT_CONFIG_CACHE_TTL = float(os.getenv("GIT_CONFIG_CACHE_TTL", "300"))
+# 用户尚未配置时的缓存秒数；新配置的失效广播丢失时，最多在这段时间内返回 404
+GIT_CONFIG_NEGATIVE_TTL = float(os.getenv("GIT_CONFIG_NEGATIVE_TTL", "10"))
+GIT_CONFIG_CACHE_SIZE = int(os.getenv("GIT_CONFIG_CACHE_SIZE", "10000"))
+GIT_CONFIG_INVALIDATE_EXCHANGE = "git_config_invalidate"
+
+_MISSING = object()
+
+
+class TTLCache:
+    """带过期时间的 LRU 缓存"""
+
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()  # key -> (过期时间, 值)
+        # 每次失效递增，防止失效前发起的查询把旧值写回缓存
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            self.misses += 1
+            return _MISSING
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def put(self, key, value, generation=None, ttl=None):
+        """
+        :param ttl: 覆盖默认的过期秒数
+        """
+        if generation is not None and generation != self.generation:
+            return
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        self.generation += 1
+        self._data.pop(key, None)
+
+    def snapshot(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._data), "generation": self.generation}
+
+
+git_config_cache = TTLCache(GIT_CONFIG_CACHE_TTL, GIT_CONFIG_CACHE_SIZE)
+
+
+async def get_git_config(user_id: str):
+    """
+    获取 webhook 鉴权所需的 git 配置，优先读进程内缓存
+
+    :return: {"password": ..., "mode": "0"/"1", "access_token": ...}，不存在时返回 None
+    """
+    config = git_config_cache.get(user_id)
+    if config is not _MISSING:
+        return config
+    generation = git_config_cache.generation
+    async with async_get_db() as db:
+        result = await db.execute(select(GitConfig).where(GitConfig.user_id == user_id))
+        gitconfig = result.scalars().first()
+    if gitconfig is None:
+        # 未配置的用户只短暂缓存，避免错过失效广播后长时间拒绝刚配置的用户
+        git_config_cache.put(user_id, None, generation, ttl=GIT_CONFIG_NEGATIVE_TTL)
+        return None
+    config = {
+        "password": gitconfig.password_hash,
+        "mode": "1" if gitconfig.mode else "0",
+        "access_token": gitconfig.access_token,
+    }
+    git_config_cache.put(user_id, config, generation)
+    return config
+
+
+async def publish_invalidation(channel, user_id: str):
+    """通知所有 webhook 进程丢弃该用户的缓存配置"""
+    exchange = await channel.declare_exchange(
+        GIT_CONFIG_INVALIDATE_EXCHANGE, aio_pika.ExchangeType.FANOUT
+    )
+    await exchange.publish(aio_pika.Message(body=user_id.encode()), routing_key="")
+
+
+async def subscribe_invalidations(channel):
+    """当前进程订阅配置失效广播，应用启动时调用一次"""
+    exchange = await channel.declare_exchange(
+        GIT_CONFIG_INVALIDATE_EXCHANGE, aio_pika.ExchangeType.FANOUT
+    )
+    queue = await channel.declare_queue(exclusive=True, auto_delete=True)
+    await queue.bind(exchange)
+
+    async def on_message(message: aio_pika.IncomingMessage):
+        async with message.process():
+            git_config_cache.invalidate(message.body.decode())
+
+    await queue.consume(on_message)
+    return queue
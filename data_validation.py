@@ -6,6 +6,7 @@ from sqlalchemy import select, delete
 from app.models.models import File as FileModel, VulnerabilityReport, Message, TaskStatus
 
 from app.models.database import async_get_db  # 导入优化后的异步数据库连接函数
+from app.services.output_parser import parse_line_lists
 security_issues = {
     "输入验证": [
         "关键状态数据外部可控", "数据真实性验证", "绕过数据净化和验证",
@@ -92,16 +93,8 @@ def type_verification(type_dict):
     return type_true
 
 def snippet_verification(snippet):
-    snippet_true = []
-    for i in snippet:
-        try:
-            j = eval(i)
-            int_list = [int(item) for item in j]
-            snippet_true.append(int_list)
-        except:
-            int_list = []
-            snippet_true.append(int_list)
-    return snippet_true
+    # 严格解析行号，不执行模型输出；无法识别的返回空列表
+    return parse_line_lists(snippet)
 
 def get_line(value, line_count):
     if len(value) == 1:
@@ -0,0 +1,186 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, insert, select
+
+from app.models.database import async_get_db
+from app.models.models import WebhookDelivery
+
+logger = logging.getLogger(__name__)
+
+# 进程内记住最近处理过的键，命中时无需访问数据库
+WEBHOOK_DEDUP_WINDOW = int(os.getenv("WEBHOOK_DEDUP_WINDOW", "100000"))
+# webhook 投递与提交文件记录保留的天数，平台的重试与重复推送都远早于此；每隔 interval 秒清理一次，每批删除 batch 行
+WEBHOOK_DEDUP_RETENTION_DAYS = float(os.getenv("WEBHOOK_DEDUP_RETENTION_DAYS", "30"))
+# (blob, 路径) 审计记录保留的天数：未改动的文件在之后的推送中仍会出现，过期后会被重新审计一次
+BLOB_AUDIT_RETENTION_DAYS = float(os.getenv("BLOB_AUDIT_RETENTION_DAYS", "180"))
+WEBHOOK_DEDUP_PURGE_INTERVAL = float(os.getenv("WEBHOOK_DEDUP_PURGE_INTERVAL", "3600"))
+WEBHOOK_DEDUP_PURGE_BATCH = int(os.getenv("WEBHOOK_DEDUP_PURGE_BATCH", "5000"))
+
+# 各平台携带投递 ID 的请求头，平台重试时保持不变
+DELIVERY_ID_HEADERS = (
+    "x-github-delivery",
+    "x-gitea-delivery",
+    "x-gitlab-event-uuid",
+    "idempotency-key",
+)
+
+
+def delivery_key(user_id: str, headers: dict):
+    """根据投递 ID 请求头生成去重键，平台未提供时返回 None"""
+    for name in DELIVERY_ID_HEADERS:
+        value = headers.get(name)
+        if value:
+            return hashlib.sha256(f"delivery|{user_id}|{name}|{value}".encode()).hexdigest()
+    return None
+
+
+def commit_file_key(user_id: str, commit: dict, path=None):
+    """
+    (仓库, 提交 SHA, 路径) 的去重键
+
+    提交 url 已包含仓库地址与 SHA；diff 模式按整个提交去重，path 为 None
+    """
+    return hashlib.sha256(f"file|{user_id}|{commit['url']}|{commit['id']}|{path or ''}".encode()).hexdigest()
+
+
+def blob_audit_key(user_id: str, blob_sha: str, path: str):
+    """(用户, blob SHA, 路径) 的去重键：相同内容出现在新路径时仍会审计该路径"""
+    return hashlib.sha256(f"blob|{user_id}|{blob_sha}|{path}".encode()).hexdigest()
+
+
+# 键的类别 -> 保留天数
+RETENTION_DAYS = {
+    "delivery": WEBHOOK_DEDUP_RETENTION_DAYS,
+    "commit_file": WEBHOOK_DEDUP_RETENTION_DAYS,
+    "blob": BLOB_AUDIT_RETENTION_DAYS,
+}
+
+
+class DeliveryDeduplicator:
+    """有界内存窗口 + webhook_deliveries 表的去重器，键按类别（delivery、commit_file、blob）分别清理"""
+
+    def __init__(self, window: int):
+        self.window = window
+        self._recent = OrderedDict()
+        self.duplicates = 0  # 重复的 webhook 投递，只由 claim 计数
+        self.skipped = {}  # seen_many 的调用方 -> 已登记的键数
+        self.purged = 0
+        self._next_purge = 0.0
+        self._purge_task = None
+
+    def _remember(self, key: str):
+        self._recent[key] = None
+        self._recent.move_to_end(key)
+        while len(self._recent) > self.window:
+            self._recent.popitem(last=False)
+
+    async def claim(self, key: str) -> bool:
+        """
+        原子地登记一个键
+
+        :return: 首次出现返回 True，重复返回 False
+        """
+        if key in self._recent:
+            self._recent.move_to_end(key)
+            self.duplicates += 1
+            return False
+        self._maybe_purge()
+        async with async_get_db() as db:
+            result = await db.execute(
+                insert(WebhookDelivery).prefix_with("IGNORE").values(delivery_key=key, kind="delivery")
+            )
+            await db.commit()
+        self._remember(key)
+        if result.rowcount == 0:
+            self.duplicates += 1
+            return False
+        return True
+
+    async def release(self, key: str):
+        """处理失败时撤销登记，让平台重试能够重新处理"""
+        self._recent.pop(key, None)
+        async with async_get_db() as db:
+            await db.execute(delete(WebhookDelivery).where(WebhookDelivery.delivery_key == key))
+            await db.commit()
+
+    async def seen_many(self, keys, kind: str):
+        """
+        批量检查键是否已登记
+
+        :param kind: 键的类别（commit_file、blob），命中数按类别分别统计
+        :return: 与 keys 顺序一致的布尔列表
+        """
+        unknown = [key for key in keys if key not in self._recent]
+        if unknown:
+            async with async_get_db() as db:
+                result = await db.execute(
+                    select(WebhookDelivery.delivery_key).where(WebhookDelivery.delivery_key.in_(unknown))
+                )
+                for key in result.scalars().all():
+                    self._remember(key)
+        seen = [key in self._recent for key in keys]
+        self.skipped[kind] = self.skipped.get(kind, 0) + sum(seen)
+        return seen
+
+    async def record_many(self, keys, kind: str):
+        """
+        批量登记已处理完成的键，已存在的键忽略
+
+        :param kind: 键的类别，决定保留期
+        """
+        if not keys:
+            return
+        self._maybe_purge()
+        async with async_get_db() as db:
+            await db.execute(
+                insert(WebhookDelivery).prefix_with("IGNORE"),
+                [{"delivery_key": key, "kind": kind} for key in keys],
+            )
+            await db.commit()
+        for key in keys:
+            self._remember(key)
+
+    def _maybe_purge(self):
+        """距上次清理超过 WEBHOOK_DEDUP_PURGE_INTERVAL 时在后台清理过期记录，不阻塞当前请求"""
+        now = time.monotonic()
+        if now < self._next_purge or (self._purge_task and not self._purge_task.done()):
+            return
+        self._next_purge = now + WEBHOOK_DEDUP_PURGE_INTERVAL
+        self._purge_task = asyncio.get_running_loop().create_task(self.purge_expired())
+
+    async def purge_expired(self):
+        """按类别与 created_at 分批删除超过各自保留期的记录，避免一次长事务锁住整张表"""
+        now = datetime.now()
+        try:
+            for kind, days in RETENTION_DAYS.items():
+                cutoff = now - timedelta(days=days)
+                while True:
+                    async with async_get_db() as db:
+                        result = await db.execute(
+                            delete(WebhookDelivery)
+                            .where(WebhookDelivery.kind == kind, WebhookDelivery.created_at < cutoff)
+                            .with_dialect_options(mysql_limit=WEBHOOK_DEDUP_PURGE_BATCH)
+                        )
+                        await db.commit()
+                    self.purged += result.rowcount
+                    if result.rowcount < WEBHOOK_DEDUP_PURGE_BATCH:
+                        break
+        except Exception as e:
+            logger.warning(f"清理过期 webhook 去重记录失败: {e}")
+
+    def snapshot(self):
+        return {
+            "duplicates": self.duplicates,
+            **{f"skipped_{kind}": count for kind, count in self.skipped.items()},
+            "window_entries": len(self._recent),
+            "purged": self.purged,
+        }
+
+
+delivery_dedup = DeliveryDeduplicator(WEBHOOK_DEDUP_WINDOW)
@@ -0,0 +1,103 @@
+import json
+import os
+import re
+
+import aiofiles
+
+# diff 模式下保留的变更上下文行数，上限为平台 diff 自带的上下文（通常为 3 行）
+DIFF_CONTEXT_LINES = int(os.getenv("DIFF_CONTEXT_LINES", "3"))
+# 不相邻的变更区域之间插入的分隔行
+HUNK_SEPARATOR = "..."
+# 行号映射与待审计文件分开存放：file/.lines/{user_id}/{file_id}.json
+LINE_MAP_DIR = os.path.join("file", ".lines")
+
+_HUNK_HEADER = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,\d+)? @@")
+
+
+class HunkBuilder:
+    """收集单个文件 diff 的 hunk，并记录每一行在新文件中的行号"""
+
+    def __init__(self):
+        self.hunks = []  # 每个 hunk 为 [(新文件行号, 内容, 是否新增)]
+        self._next_line = None
+
+    def feed(self, line: str):
+        match = _HUNK_HEADER.match(line)
+        if match:
+            self._next_line = int(match.group(1))
+            self.hunks.append([])
+            return
+        if self._next_line is None:
+            return
+        if line.startswith("+"):
+            self.hunks[-1].append((self._next_line, line[1:], True))
+            self._next_line += 1
+        elif line.startswith(" ") or line == "":
+            self.hunks[-1].append((self._next_line, line[1:], False))
+            self._next_line += 1
+        # "-" 删除行与 "\ No newline" 不占新文件行号
+
+    @property
+    def has_changes(self) -> bool:
+        return any(added for hunk in self.hunks for _, _, added in hunk)
+
+    def render(self, context: int = DIFF_CONTEXT_LINES):
+        """
+        只保留新增行及其前后 context 行
+
+        :return: (文本, 行号列表)，行号列表与文本逐行对应，分隔行对应 None
+        """
+        lines = []
+        numbers = []
+        last = None
+        for hunk in self.hunks:
+            selected = set()
+            for i, (_, _, added) in enumerate(hunk):
+                if added:
+                    selected.update(range(max(0, i - context), min(len(hunk), i + context + 1)))
+            for i in sorted(selected):
+                number, text, _ = hunk[i]
+                if last is not None and number != last + 1:
+                    lines.append(HUNK_SEPARATOR)
+                    numbers.append(None)
+                lines.append(text)
+                numbers.append(number)
+                last = number
+        return ''.join(f"{line}\n" for line in lines), numbers
+
+
+def get_file_hunks(diff: str, context: int = DIFF_CONTEXT_LINES):
+    """解析单个文件的 diff 文本，返回 (文本, 行号列表)"""
+    builder = HunkBuilder()
+    for line in diff.splitlines():
+        builder.feed(line)
+    return builder.render(context)
+
+
+def line_map_path(user_id: str, file_id: str) -> str:
+    return os.path.join(LINE_MAP_DIR, user_id, f"{file_id}.json")
+
+
+async def write_line_map(user_id: str, file_id: str, numbers=None):
+    """
+    写入 diff 模式文件的行号映射；numbers 为 None 表示整文件，删除已有映射
+
+    整文件审计写入同一路径时必须删除映射，否则会沿用旧的行号
+    """
+    path = line_map_path(user_id, file_id)
+    if numbers is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    async with aiofiles.open(path, mode="w", encoding="utf-8") as f:
+        await f.write(json.dumps(numbers))
+
+
+async def read_line_map(user_id: str, file_id: str):
+    """读取行号映射，整文件审计时返回 None"""
+    path = line_map_path(user_id, file_id)
+    if not os.path.exists(path):
+        return None
+    async with aiofiles.open(path, mode="r", encoding="utf-8") as f:
+        return json.loads(await f.read())
@@ -0,0 +1,113 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+
+# 任务优先级，数值越大越先处理：diff 审计优先于整文件审计
+PRIORITY_DIFF = 5
+PRIORITY_FILE = 1
+# 任务队列声明的 x-max-priority，不能小于上面的任何优先级
+MAX_PRIORITY = PRIORITY_DIFF
+
+
+def parse_weights(value: str):
+    """解析 "user1:3,user2:2" 形式的用户权重配置"""
+    weights = {}
+    for item in value.split(","):
+        if ":" in item:
+            tenant, weight = item.rsplit(":", 1)
+            weights[tenant.strip()] = max(1, int(weight))
+    return weights
+
+
+TENANT_WEIGHTS = parse_weights(os.getenv("TENANT_WEIGHTS", ""))
+
+
+class TenantStats:
+    def __init__(self):
+        self.depth = 0
+        self.dispatched = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+
+class FairScheduler:
+    """
+    进程内的多用户公平调度器
+
+    先按优先级从高到低选择，同一优先级内按用户加权轮询：权重为 w 的用户每轮最多连续
+    取出 w 个任务。
+
+    公平性只作用于已预取到本进程的窗口（CHAT_SCHEDULER_PREFETCH / AUDIT_SCHEDULER_PREFETCH 条）：broker 队列按优先级、
+    同一优先级内按先后顺序投递，单个用户的大量任务仍会排在其它用户的同级任务之前，
+    只是在窗口内不再独占并发名额。彻底消除队头阻塞需要按用户分队列路由。
+    """
+
+    def __init__(self, weights=None):
+        self.weights = weights if weights is not None else TENANT_WEIGHTS
+        self._levels = {}  # priority -> OrderedDict[tenant -> deque[(入队时间, item)]]
+        self._credits = {}  # (priority, tenant) -> 本轮剩余可取数量
+        self._size = 0
+        self._not_empty = asyncio.Event()
+        self.stats = {}  # tenant -> TenantStats
+
+    def __len__(self):
+        return self._size
+
+    def put(self, tenant: str, item, priority: int = 0):
+        tenants = self._levels.setdefault(priority, OrderedDict())
+        tenants.setdefault(tenant, deque()).append((time.monotonic(), item))
+        self.stats.setdefault(tenant, TenantStats()).depth += 1
+        self._size += 1
+        self._not_empty.set()
+
+    def get_nowait(self):
+        """
+        取出下一个任务
+
+        :return: (tenant, item)，没有任务时抛出 asyncio.QueueEmpty
+        """
+        if not self._size:
+            raise asyncio.QueueEmpty
+        priority = max(p for p, tenants in self._levels.items() if tenants)
+        tenants = self._levels[priority]
+        tenant, items = next(iter(tenants.items()))
+        enqueued_at, item = items.popleft()
+        key = (priority, tenant)
+        credits = self._credits.get(key, self.weights.get(tenant, 1)) - 1
+        if not items:
+            del tenants[tenant]
+            self._credits.pop(key, None)
+        elif credits <= 0:
+            tenants.move_to_end(tenant)
+            self._credits.pop(key, None)
+        else:
+            self._credits[key] = credits
+        self._size -= 1
+        if not self._size:
+            self._not_empty.clear()
+
+        wait = time.monotonic() - enqueued_at
+        stats = self.stats[tenant]
+        stats.depth -= 1
+        stats.dispatched += 1
+        stats.wait_seconds += wait
+        stats.max_wait_seconds = max(stats.max_wait_seconds, wait)
+        return tenant, item
+
+    async def get(self):
+        while not self._size:
+            await self._not_empty.wait()
+        return self.get_nowait()
+
+    def snapshot(self):
+        """各用户的队列深度与等待时间"""
+        return {
+            tenant: {
+                "depth": stats.depth,
+                "dispatched": stats.dispatched,
+                "wait_seconds": stats.wait_seconds,
+                "max_wait_seconds": stats.max_wait_seconds,
+            }
+            for tenant, stats in self.stats.items()
+        }
@@ -1,15 +1,27 @@
-from fastapi import APIRouter
+import logging
+
+from fastapi import APIRouter, Request
 from sqlalchemy import select
 from starlette.responses import JSONResponse
 from app.config.schemas import GitConfigCreate
 from app.models.database import async_get_db
 from app.models.models import GitConfig
+from app.services.config_cache import git_config_cache, publish_invalidation
 
 router = APIRouter()
 
+
+async def invalidate_git_config(request: Request, user_id: str):
+    """配置写入后清除本进程缓存，并广播给其它 webhook 进程"""
+    git_config_cache.invalidate(user_id)
+    try:
+        await publish_invalidation(request.app.state.channel, user_id)
+    except Exception as e:
+        logging.warning(f"git config invalidation broadcast failed: {e}")
+
 # 任务状态查询接口
 @router.post("/")
-async def create_git_config(config: GitConfigCreate):
+async def create_git_config(config: GitConfigCreate, request: Request):
     try:
         user_id = config.username
         access_token = config.access_token
@@ -29,11 +41,13 @@ async def create_git_config(config: GitConfigCreate):
                 existing_config.password_hash = password_hash
                 existing_config.mode = mode
                 await db.commit()
+                await invalidate_git_config(request, user_id)
                 return JSONResponse(status_code=200, content={"webhook_url": f"http://124.128.55.46:10002/webhook/{user_id}"})
             else:
                 db_config = GitConfig(user_id = user_id, access_token = access_token, password_hash = password_hash, git_type = git_type, mode = mode)
                 db.add(db_config)
                 await db.commit()
+                await invalidate_git_config(request, user_id)
                 return JSONResponse(status_code=200, content={"webhook_url": f"http://124.128.55.46:10002/webhook/{user_id}"})
     except Exception as e:
         return JSONResponse(
@@ -0,0 +1,112 @@
+import asyncio
+import importlib.util
+import logging
+import os
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# 访问各 git 平台的共享连接池配置，可通过环境变量覆盖
+GIT_HTTP_MAX_CONNECTIONS = int(os.getenv("GIT_HTTP_MAX_CONNECTIONS", "100"))
+GIT_HTTP_MAX_PER_HOST = int(os.getenv("GIT_HTTP_MAX_PER_HOST", "20"))
+GIT_HTTP_MAX_KEEPALIVE = int(os.getenv("GIT_HTTP_MAX_KEEPALIVE", "20"))
+GIT_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("GIT_HTTP_KEEPALIVE_EXPIRY", "30"))
+GIT_HTTP_CONNECT_TIMEOUT = float(os.getenv("GIT_HTTP_CONNECT_TIMEOUT", "5"))
+GIT_HTTP_READ_TIMEOUT = float(os.getenv("GIT_HTTP_READ_TIMEOUT", "60"))
+GIT_HTTP_WRITE_TIMEOUT = float(os.getenv("GIT_HTTP_WRITE_TIMEOUT", "30"))
+GIT_HTTP_POOL_TIMEOUT = float(os.getenv("GIT_HTTP_POOL_TIMEOUT", "30"))
+GIT_HTTP2 = os.getenv("GIT_HTTP2", "0") == "1"
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """响应体读取完毕（或关闭）时释放所属主机的并发名额"""
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            self._release()
+
+
+class HostLimitedTransport(httpx.AsyncBaseTransport):
+    """
+    在 httpx 连接池之上按主机限制并发请求数
+
+    httpx.Limits 只能限制整个连接池的连接数，这里为每个主机额外维护一个信号量，
+    避免一次大推送占满连接池、拖慢访问其它 git 平台的请求。
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, max_per_host: int):
+        self._transport = transport
+        self._max_per_host = max_per_host
+        self._semaphores = {}
+
+    def _semaphore(self, host):
+        semaphore = self._semaphores.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self._max_per_host)
+            self._semaphores[host] = semaphore
+        return semaphore
+
+    async def handle_async_request(self, request):
+        semaphore = self._semaphore(request.url.host)
+        await semaphore.acquire()
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                semaphore.release()
+
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            release()
+            raise
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_ReleasingStream(response.stream, release),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """
+    创建访问 git 平台的长连接客户端，应用启动时创建一次，关闭时调用 aclose()
+
+    :return: 带连接池、keep-alive 与按主机并发限制的 httpx.AsyncClient
+    """
+    http2 = GIT_HTTP2
+    if http2 and importlib.util.find_spec("h2") is None:
+        logger.warning("GIT_HTTP2 已开启但未安装 h2，回退到 HTTP/1.1")
+        http2 = False
+    limits = httpx.Limits(
+        max_connections=GIT_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=GIT_HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=GIT_HTTP_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(
+        connect=GIT_HTTP_CONNECT_TIMEOUT,
+        read=GIT_HTTP_READ_TIMEOUT,
+        write=GIT_HTTP_WRITE_TIMEOUT,
+        pool=GIT_HTTP_POOL_TIMEOUT,
+    )
+    transport = HostLimitedTransport(
+        httpx.AsyncHTTPTransport(limits=limits, http2=http2),
+        GIT_HTTP_MAX_PER_HOST,
+    )
+    return httpx.AsyncClient(transport=transport, timeout=timeout)
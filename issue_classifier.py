@@ -0,0 +1,168 @@
+import os
+import re
+import unicodedata
+
+from app.services.data_validation import security_issues
+
+# 本地匹配的置信度低于该值时回退到 LLM 归类
+ISSUE_CLASSIFIER_THRESHOLD = float(os.getenv("ISSUE_CLASSIFIER_THRESHOLD", "0.75"))
+
+# 模型常用说法 -> security_issues 中的 (一级标题, 二级标题)
+SYNONYMS = {
+    "sql注入": ("数据库管理", "SQL 注入"),
+    "sql injection": ("数据库管理", "SQL 注入"),
+    "数据库连接未释放": ("数据库管理", "及时释放数据库资源"),
+    "命令注入": ("输入验证", "命令行注入"),
+    "命令执行": ("输入验证", "命令行注入"),
+    "command injection": ("输入验证", "命令行注入"),
+    "跨站脚本": ("输入验证", "对HTTP头Web脚本特殊元素处理"),
+    "xss": ("输入验证", "对HTTP头Web脚本特殊元素处理"),
+    "整数溢出": ("输入验证", "数值赋值越界"),
+    "除以零": ("输入验证", "除零错误"),
+    "死代码": ("输入验证", "无法执行的死代码"),
+    "硬编码": ("输出编码", "使用安全相关的硬编码"),
+    "弱随机数": ("输出编码", "随机数安全"),
+    "不安全的随机数": ("输出编码", "随机数安全"),
+    "弱加密": ("输出编码", "密码安全"),
+    "不安全的加密": ("输出编码", "密码安全"),
+    "弱哈希": ("输出编码", "密码安全"),
+    "md5": ("输出编码", "密码安全"),
+    "sha1": ("输出编码", "密码安全"),
+    "信息泄露": ("数据保护", "敏感信息暴露"),
+    "敏感信息泄露": ("数据保护", "敏感信息暴露"),
+    "隐私泄露": ("数据保护", "个人信息保护"),
+    "认证绕过": ("访问控制", "身份鉴别被绕过"),
+    "身份验证绕过": ("访问控制", "身份鉴别被绕过"),
+    "暴力破解": ("访问控制", "身份鉴别尝试频率限制"),
+    "明文密码": ("口令安全", "明文存储口令"),
+    "弱口令": ("口令安全", "登录口令"),
+    "越权": ("权限管理", "权限访问控制"),
+    "未授权访问": ("权限管理", "权限访问控制"),
+    "日志注入": ("日志安全", "对输出日志中特殊元素处理"),
+    "竞态条件": ("并发程序安全", "共享资源的并发安全"),
+    "条件竞争": ("并发程序安全", "共享资源的并发安全"),
+    "格式化字符串漏洞": ("函数调用安全", "格式化字符串"),
+    "参数校验": ("函数调用安全", "对方法或函数参数验证"),
+    "输入验证不足": ("函数调用安全", "对方法或函数参数验证"),
+    "异常处理": ("异常处理安全", "异常处理安全"),
+    "空指针": ("指针安全", "无效指针使用"),
+    "双重释放": ("资源管理", "重复释放资源"),
+    "资源泄漏": ("资源管理", "资源不安全清理"),
+    "死循环": ("资源管理", "无限循环"),
+    "拒绝服务": ("资源管理", "算法复杂度攻击"),
+    "内存泄漏": ("内存管理", "内存未释放"),
+    "释放后使用": ("内存管理", "访问已释放内存"),
+    "use after free": ("内存管理", "访问已释放内存"),
+    "缓冲区溢出": ("内存管理", "缓冲区复制造成溢出"),
+    "目录遍历": ("文件管理", "路径遍历"),
+    "路径穿越": ("文件管理", "路径遍历"),
+    "文件句柄泄漏": ("文件管理", "及时释放文件系统资源"),
+    "明文传输": ("网络传输", "通信安全"),
+    "会话固定": ("网络传输", "会话标识符"),
+}
+
+# 漏洞名称中不影响归类的泛称，计算同义词覆盖比例时不计入
+GENERIC_WORDS = ("漏洞", "问题", "风险", "缺陷", "攻击", "vulnerability", "issue", "risk", "attack")
+
+_PUNCTUATION = re.compile(r"[\s\W_]+")
+_GENERIC = re.compile("|".join(GENERIC_WORDS))
+
+
+def normalize(text) -> str:
+    """全角转半角、转小写并去掉空白和标点"""
+    text = unicodedata.normalize("NFKC", str(text)).lower()
+    return _PUNCTUATION.sub("", text)
+
+
+def spaced(text) -> str:
+    """全角转半角、转小写，空白和标点统一为一个空格，保留英文单词边界"""
+    text = unicodedata.normalize("NFKC", str(text)).lower()
+    return _PUNCTUATION.sub(" ", text).strip()
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isascii() and char.isalnum()
+
+
+def synonym_pattern(word: str):
+    """
+    同义词的匹配模式：英文单词两端必须是单词边界，单词之间的空格可省略
+
+    例如 "xss" 不会匹配 "xssfilter" 中的片段，"sql injection" 同时匹配 "sqlinjection"
+    """
+    text = spaced(word)
+    body = r"\s?".join(re.escape(part) for part in text.split())
+    prefix = r"(?<![a-z0-9])" if _is_word_char(text[0]) else ""
+    suffix = r"(?![a-z0-9])" if _is_word_char(text[-1]) else ""
+    return re.compile(prefix + body + suffix)
+
+
+def ngrams(text: str, n: int = 2):
+    if len(text) <= n:
+        return {text}
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class IssueIndex:
+    """
+    security_issues 的预计算索引：精确、归一化、同义词与字符 n-gram 四级匹配
+
+    同义词只按单词边界匹配，且只有覆盖了名称的主要部分时才给出高置信度；泛化的名称
+    （例如只含 "injection" 的长句）只能得到较低的置信度，交给 LLM 归类。
+    """
+
+    def __init__(self, taxonomy, synonyms):
+        self.taxonomy = taxonomy
+        self.exact = {}  # 归一化二级标题 -> (一级标题, 二级标题)
+        self.leaves = []  # (一级标题, 二级标题, 归一化标题, n-gram)
+        for category, names in taxonomy.items():
+            for name in names:
+                key = normalize(name)
+                self.exact.setdefault(key, (category, name))
+                self.leaves.append((category, name, key, ngrams(key)))
+        self.categories = {normalize(category): category for category in taxonomy}
+        self.synonyms = sorted(
+            ((synonym_pattern(word), len(normalize(word)), target) for word, target in synonyms.items()),
+            key=lambda item: -item[1],
+        )
+
+    def match(self, defect_type, defect_name):
+        """
+        匹配一条漏洞的分类
+
+        :return: (一级标题, 二级标题, 置信度)，置信度在 0 到 1 之间
+        """
+        if defect_name in self.taxonomy.get(defect_type, ()):
+            return defect_type, defect_name, 1.0
+        name = normalize(defect_name)
+        category = self.categories.get(normalize(defect_type))
+        if name in self.exact:
+            exact_category, exact_name = self.exact[name]
+            if category and exact_name in self.taxonomy[category]:
+                return category, exact_name, 0.95
+            return exact_category, exact_name, 0.95
+        text = spaced(defect_name)
+        # 去掉泛称后名称的有效长度，用于判断同义词是否覆盖了名称的主要部分
+        core = len(normalize(_GENERIC.sub("", text))) or len(name)
+        # 指向同一分类的同义词（如 "跨站脚本" 与 "xss"）合计覆盖长度
+        covered = {}
+        for pattern, length, target in self.synonyms:
+            if pattern.search(text):
+                covered[target] = covered.get(target, 0) + length
+        if covered:
+            target, length = max(covered.items(), key=lambda item: item[1])
+            return target[0], target[1], 0.9 if length * 2 >= core else 0.7
+
+        best = (None, None, 0.0)
+        grams = ngrams(name)
+        for leaf_category, leaf_name, key, leaf_grams in self.leaves:
+            score = 2 * len(grams & leaf_grams) / (len(grams) + len(leaf_grams))
+            if leaf_category == category:
+                score = min(1.0, score + 0.1)
+            if score > best[2]:
+                best = (leaf_category, leaf_name, score)
+        return best
+
+
+issue_index = IssueIndex(security_issues, SYNONYMS)
+
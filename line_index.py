@@ -0,0 +1,125 @@
+import codecs
+import hashlib
+import mmap
+import os
+from array import array
+
+# 校验编码时每次解码的字节数
+VALIDATE_BLOCK = 1 << 20
+
+
+class IdentityPositions:
+    """整文件审计时源文件行号即行位置（从 1 开始），无需逐行建立映射"""
+
+    def __init__(self, count: int):
+        self.count = count
+
+    def __contains__(self, number):
+        return isinstance(number, int) and 1 <= number <= self.count
+
+    def __getitem__(self, number):
+        if number not in self:
+            raise KeyError(number)
+        return number
+
+    def get(self, number, default=None):
+        return number if number in self else default
+
+
+class NumberedLines:
+    """带 "行号: " 前缀的行视图，支持下标与切片，按需生成"""
+
+    def __init__(self, index):
+        self._index = index
+
+    def __len__(self):
+        return len(self._index)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self._numbered(i) for i in range(*item.indices(len(self._index)))]
+        if item < 0:
+            item += len(self._index)
+        return self._numbered(item)
+
+    def _numbered(self, i: int) -> str:
+        line = self._index[i]
+        number = self._index.number(i)
+        return line if number is None else f"{number}: {line}"
+
+
+class LineIndex:
+    """
+    待审计文件的只读访问层：mmap 映射文件，只保存每行的起始偏移
+
+    按下标取行时才解码，行尾统一为 \\n，与文本模式 readlines 的结果一致。
+    与按文本模式读取一样严格按 UTF-8 解码：打开时整体校验一次，无法解码的文件抛出 UnicodeDecodeError。
+    """
+
+    def __init__(self, path: str):
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        # 空文件不能 mmap
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        try:
+            self._validate(size)
+        except UnicodeDecodeError:
+            self.close()
+            raise
+        self._offsets = array("Q", [0])
+        pos = 0
+        while True:
+            pos = self._data.find(b"\n", pos) + 1
+            if not pos:
+                break
+            self._offsets.append(pos)
+        if self._offsets[-1] != size:
+            self._offsets.append(size)
+        self.line_numbers = None
+        self.positions = IdentityPositions(len(self))
+        self.numbered = NumberedLines(self)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        text = self._data[self._offsets[i]:self._offsets[i + 1]].decode("utf-8")
+        if text.endswith("\r\n"):
+            return text[:-2] + "\n"
+        return text
+
+    def _validate(self, size: int):
+        """分块增量解码整个文件，只校验不保留结果"""
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        for pos in range(0, size, VALIDATE_BLOCK):
+            decoder.decode(self._data[pos:pos + VALIDATE_BLOCK])
+        decoder.decode(b"", final=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def set_line_numbers(self, line_numbers):
+        """
+        使用 diff 模式的行号映射，None 表示分隔行
+
+        :param line_numbers: 与文件逐行对应的源文件行号
+        """
+        self.line_numbers = line_numbers
+        self.positions = {number: i + 1 for i, number in enumerate(line_numbers) if number is not None}
+
+    def number(self, i: int):
+        """第 i 行（下标从 0 开始）对应的源文件行号"""
+        if self.line_numbers is None:
+            return i + 1
+        return self.line_numbers[i]
+
+    def digest(self) -> str:
+        return hashlib.sha256(self._data).hexdigest()
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
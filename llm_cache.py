@@ -0,0 +1,133 @@
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 审计结果缓存：SQLite 单文件，超过容量后按最近使用时间淘汰
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join("file", ".llm_cache.sqlite3"))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+
+class LLMCache:
+    """
+    以 (模型, 提示词版本, cobra 结果, 代码块) 哈希为键缓存 LLM 审计响应
+
+    命中时不再计费：调用方拿到的 token 用量为 0，节省的 token 记在 stats 中。
+    sqlite3 为阻塞调用，读写都放到线程中执行。
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._conn = None
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "saved_prompt_tokens": 0,
+            "saved_completion_tokens": 0,
+        }
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(str(part).encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def _connection(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+                "prompt_tokens INTEGER NOT NULL, completion_tokens INTEGER NOT NULL, "
+                "size INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_used ON llm_cache (last_used)")
+            self._bytes = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    def _get(self, key):
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT response, prompt_tokens, completion_tokens FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                conn.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+                conn.commit()
+            return row
+
+    def _put(self, key, response, tokens):
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            conn = self._connection()
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO llm_cache VALUES (?, ?, ?, ?, ?, ?)",
+                (key, response, tokens[0], tokens[1], size, time.time()),
+            )
+            if cursor.rowcount:
+                self._bytes += size
+            if self._bytes > self.max_bytes:
+                # 其它进程也在写入，淘汰前重新统计总量
+                self._bytes = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+                while self._bytes > self.max_bytes:
+                    rows = conn.execute(
+                        "SELECT key, size FROM llm_cache ORDER BY last_used LIMIT 100"
+                    ).fetchall()
+                    if not rows:
+                        break
+                    for old_key, old_size in rows:
+                        conn.execute("DELETE FROM llm_cache WHERE key = ?", (old_key,))
+                        self._bytes -= old_size
+                        self.stats["evictions"] += 1
+                        if self._bytes <= self.max_bytes:
+                            break
+            conn.commit()
+
+    async def get(self, key: str):
+        """
+        :return: 缓存的响应文本，未命中时返回 None
+        """
+        try:
+            row = await asyncio.to_thread(self._get, key)
+        except sqlite3.Error as e:
+            logger.warning(f"LLM 缓存读取失败: {e}")
+            row = None
+        if row is None:
+            self.stats["misses"] += 1
+            return None
+        response, prompt_tokens, completion_tokens = row
+        self.stats["hits"] += 1
+        self.stats["saved_prompt_tokens"] += prompt_tokens
+        self.stats["saved_completion_tokens"] += completion_tokens
+        return response
+
+    async def put(self, key: str, response: str, tokens):
+        """
+        :param tokens: 本次调用的 token 用量，命中时计入节省统计
+        """
+        try:
+            await asyncio.to_thread(self._put, key, response, tuple(tokens))
+        except sqlite3.Error as e:
+            logger.warning(f"LLM 缓存写入失败: {e}")
+
+    def snapshot(self):
+        return {**self.stats, "bytes": self._bytes}
+
+
+llm_cache = LLMCache(LLM_CACHE_PATH, LLM_CACHE_MAX_BYTES)
@@ -1,8 +1,19 @@
-
+import os
+import aio_pika
 import uvicorn
 from fastapi import FastAPI
 from app.routers import webhook, git_config
+from app.services.http_client import create_http_client
+from app.ingest_worker import consume_push_events, RABBITMQ_URL
+from app.services.config_cache import subscribe_invalidations, git_config_cache
+from app.services.metrics import metrics, CONTENT_TYPE
+from app.services.queue_publisher import publish_stats, declare_task_queue
+from app.services.blob_store import blob_store
+from app.services.delivery_dedup import delivery_dedup
+from fastapi.responses import Response
 
+# 开启后在 webhook 进程内消费 push_events，否则需单独运行 ingest_worker.py
+INGEST_IN_PROCESS = os.getenv("WEBHOOK_INGEST_IN_PROCESS", "0") == "1"
 
 app = FastAPI()
 
@@ -11,5 +22,41 @@ app = FastAPI()
 app.include_router(webhook.router, prefix="/webhook", tags=["webhook"])
 app.include_router(git_config.router, prefix="/git_config", tags=["git_config"])
 
+# 已有模块的统计在输出 /metrics 时采集
+metrics.register_collector("webhook_publish", publish_stats.snapshot)
+metrics.register_collector("webhook_blob_store", blob_store.snapshot)
+metrics.register_collector("webhook_git_config_cache", git_config_cache.snapshot)
+metrics.register_collector("webhook_delivery_dedup", delivery_dedup.snapshot)
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus 文本格式的进程指标"""
+    return Response(content=metrics.render(), media_type=CONTENT_TYPE)
+
+
+@app.on_event("startup")
+async def startup():
+    # 所有 git 平台请求共用一个长连接客户端，避免每个文件都重新握手
+    app.state.http_client = create_http_client()
+    # 发布审计任务、推送事件与配置失效广播共用一个 RabbitMQ 通道
+    app.state.rabbitmq_connection = await aio_pika.connect_robust(RABBITMQ_URL)
+    app.state.channel = await app.state.rabbitmq_connection.channel()
+    # 审计任务带优先级发布，队列需声明 x-max-priority 后 broker 才会按优先级投递
+    await declare_task_queue(app.state.channel, "webhook_tasks")
+    # 接收其它进程广播的 git 配置失效通知
+    await subscribe_invalidations(app.state.channel)
+    if INGEST_IN_PROCESS:
+        app.state.ingest_consumer = await consume_push_events(app.state)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    if INGEST_IN_PROCESS:
+        queue, consumer_tag = app.state.ingest_consumer
+        await queue.cancel(consumer_tag)
+    await app.state.http_client.aclose()
+    await app.state.rabbitmq_connection.close()
+
 if __name__ == "__main__":
     uvicorn.run(app, host="127.0.0.1", port=8000)
\ No newline at end of file
@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import re
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 各阶段耗时直方图的桶上限（秒）
+STAGE_BUCKETS = (0.005, 0.025, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_INVALID_NAME = re.compile(r"[^a-zA-Z0-9_]")
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(int(value))
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Metrics:
+    """
+    进程内的计数器与直方图，按 Prometheus 文本格式输出
+
+    记录只做字典查找和加法，不加锁：所有调用都在同一个事件循环线程中。
+    """
+
+    def __init__(self):
+        self._counters = {}  # name -> {标签元组: 值}
+        self._histograms = {}  # name -> {标签元组: Histogram}
+        self._help = {}
+        self._collectors = []  # (前缀, snapshot 函数, 嵌套字典的标签名)
+
+    def inc(self, name: str, value=1, **labels):
+        series = self._counters.setdefault(name, {})
+        key = tuple(labels.items())
+        series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, buckets=STAGE_BUCKETS, **labels):
+        series = self._histograms.setdefault(name, {})
+        key = tuple(labels.items())
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram(buckets)
+        histogram.observe(value)
+
+    @contextmanager
+    def timer(self, stage: str, name: str = "audit_stage_seconds", **labels):
+        """记录 with 块的耗时，异常时同样记录"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, stage=stage, **labels)
+
+    def describe(self, name: str, text: str):
+        self._help[name] = text
+
+    def register_collector(self, prefix: str, snapshot, label: str = None):
+        """
+        输出时调用 snapshot() 采集已有模块的统计，数值字段输出为 {prefix}_{字段}
+
+        :param label: snapshot 返回 {标签值: {字段: 数值}} 时使用的标签名
+        """
+        self._collectors.append((prefix, snapshot, label))
+
+    def render(self) -> str:
+        lines = []
+        for name, series in sorted(self._counters.items()):
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} counter")
+            for key, value in series.items():
+                lines.append(f"{name}{_labels(dict(key))} {_number(value)}")
+        for name, series in sorted(self._histograms.items()):
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, histogram in series.items():
+                labels = dict(key)
+                total = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    total += count
+                    lines.append(f"{name}_bucket{_labels({**labels, 'le': bound})} {total}")
+                total += histogram.counts[-1]
+                lines.append(f"{name}_bucket{_labels({**labels, 'le': '+Inf'})} {total}")
+                lines.append(f"{name}_sum{_labels(labels)} {histogram.sum!r}")
+                lines.append(f"{name}_count{_labels(labels)} {total}")
+        for prefix, snapshot, label in self._collectors:
+            try:
+                values = snapshot()
+            except Exception as e:
+                logger.warning(f"采集 {prefix} 统计失败: {e}")
+                continue
+            rows = values.items() if label else [(None, values)]
+            for label_value, fields in rows:
+                labels = {label: label_value} if label else {}
+                for field, value in fields.items():
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        name = _INVALID_NAME.sub("_", f"{prefix}_{field}")
+                        lines.append(f"{name}{_labels(labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+metrics.describe("audit_stage_seconds", "Duration of each audit pipeline stage")
+metrics.describe("audit_llm_tokens_total", "LLM tokens charged, by prompt and direction")
+metrics.describe("audit_chunk_failures_total", "Chunks without a complete result, by reason")
+metrics.describe("audit_chunks_clean_total", "Chunks audited without any findings")
+metrics.describe("audit_streamed_findings_total", "Finding previews validated from partial audit responses")
+metrics.describe("audit_first_finding_seconds", "Time from the start of a file audit to its first finding preview")
+
+
+async def serve_http(port: int, routes: dict, host: str = "0.0.0.0"):
+    """
+    没有 Web 框架的进程使用的最小 HTTP 服务，只处理 GET
+
+    :param routes: 路径 -> 异步函数，返回 (状态码, Content-Type, 响应体)
+    :return: asyncio.Server
+    """
+    reasons = {200: "OK", 404: "Not Found", 503: "Service Unavailable"}
+
+    async def handle(reader, writer):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()).strip():
+                pass
+            parts = request_line.decode("latin-1").split()
+            route = routes.get(parts[1].split("?")[0]) if len(parts) >= 2 and parts[0] == "GET" else None
+            if route is None:
+                status, content_type, body = 404, "text/plain", "not found\n"
+            else:
+                status, content_type, body = await route()
+            body = body.encode("utf-8")
+            writer.write(
+                f"HTTP/1.1 {status} {reasons.get(status, '')}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.warning(f"HTTP 请求处理失败: {e}")
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
+
+
+async def serve_metrics(port: int, host: str = "0.0.0.0"):
+    """在 port 上提供 GET /metrics，用于 RabbitMQ 消费者等进程"""
+
+    async def render():
+        return 200, CONTENT_TYPE, metrics.render()
+
+    return await serve_http(port, {"/metrics": render}, host)
@@ -0,0 +1,10 @@
+-- webhook 投递、提交文件与 (blob, 路径) 审计记录的去重表，对应 app.models.models.WebhookDelivery
+-- 由 delivery_dedup 写入，按 created_at 超过保留期分批清理
+CREATE TABLE IF NOT EXISTS webhook_deliveries (
+    id INT NOT NULL AUTO_INCREMENT,
+    delivery_key VARCHAR(64) NOT NULL COMMENT '投递 ID、(仓库, 提交, 路径) 或 (blob, 路径) 的 sha256',
+    created_at DATETIME NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id),
+    UNIQUE KEY uq_webhook_deliveries_delivery_key (delivery_key),
+    KEY ix_webhook_deliveries_created_at (created_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
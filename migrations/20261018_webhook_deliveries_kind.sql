@@ -0,0 +1,6 @@
+-- webhook_deliveries 增加键的类别，(blob, 路径) 审计记录使用单独的保留期（BLOB_AUDIT_RETENTION_DAYS）
+-- 已有的记录无法区分类别，统一视为 delivery，按 WEBHOOK_DEDUP_RETENTION_DAYS 清理
+ALTER TABLE webhook_deliveries
+    ADD COLUMN kind VARCHAR(16) NOT NULL DEFAULT 'delivery' AFTER delivery_key,
+    ADD KEY ix_webhook_deliveries_kind_created_at (kind, created_at),
+    DROP KEY ix_webhook_deliveries_created_at;
@@ -1,6 +1,6 @@
 from datetime import date
 from enum import Enum as pyEnum
-from sqlalchemy import Column, Integer, String, DateTime, Enum as SQLAlchemyEnum, BigInteger, Text, Boolean, Date
+from sqlalchemy import Column, Integer, String, DateTime, Enum as SQLAlchemyEnum, BigInteger, Text, Boolean, Date, Index
 from sqlalchemy.dialects.mysql import MEDIUMTEXT
 from sqlalchemy.sql import func
 from app.models.database import Base
@@ -102,6 +102,16 @@ class GitConfig(Base):
     mode = Column(Boolean, nullable=False)  # 0 表示 False，1 表示 True
 
 
+class WebhookDelivery(Base):
+    """已处理的 webhook 投递、提交文件与已审计的 (blob, 路径)，用于重试和重复推送去重"""
+    __tablename__ = "webhook_deliveries"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    delivery_key = Column(String(64), unique=True, nullable=False)  # 投递 ID、(仓库, 提交, 路径) 或 (blob, 路径) 的 sha256
+    kind = Column(String(16), nullable=False, server_default="delivery")  # delivery、commit_file 或 blob，各自有保留期
+    created_at = Column(DateTime, server_default=func.now())  # 按保留期清理
+    __table_args__ = (Index("ix_webhook_deliveries_kind_created_at", "kind", "created_at"),)
+
+
 class TokenUsage(Base):
     __tablename__ = 'token_usage'
     user_id = Column(String(50), primary_key=True)             # 用户ID
@@ -0,0 +1,67 @@
+import re
+
+# 单个范围最多展开的行数，防止 "1-100000" 之类的输出展开成巨大列表
+MAX_RANGE_LINES = 200
+
+# 全角数字、标点与常见的范围写法统一为半角
+_HALF_WIDTH = str.maketrans({
+    **{chr(0xFF10 + i): str(i) for i in range(10)},
+    "，": ",", "、": ",", "；": ",", ";": ",",
+    "：": ":", "－": "-", "—": "-", "–": "-", "～": "-", "〜": "-", "~": "-",
+    "至": "-", "到": "-", "第": None, "行": None,
+})
+
+_LINE_ITEM = re.compile(r"(\d+)(?:\s*-\s*(\d+))?")
+
+# 字典项：键或值可以带半角/全角引号，也可以不带引号
+_DICT_ITEM = r"""(?:"([^"]*)"|'([^']*)'|“([^”]*)”|‘([^’]*)’|([^,，:：{}'"“”‘’\n]+))"""
+_DICT_PAIR = re.compile(rf"{_DICT_ITEM}\s*[:：]\s*{_DICT_ITEM}")
+
+
+def parse_line_list(text) -> list:
+    """
+    解析模型给出的行号，如 "[1, 2]"、"12-18"、"［３，５］"、"第12行至第15行"
+
+    不执行任何代码，无法识别时返回空列表
+
+    :return: 去重后按出现顺序排列的行号
+    """
+    if isinstance(text, (list, tuple)):
+        text = ",".join(str(item) for item in text)
+    numbers = {}
+    for start, end in _LINE_ITEM.findall(str(text).translate(_HALF_WIDTH)):
+        first = int(start)
+        last = int(end) if end else first
+        if last < first or last - first >= MAX_RANGE_LINES:
+            numbers[first] = None
+            if end:
+                numbers[last] = None
+            continue
+        for number in range(first, last + 1):
+            numbers[number] = None
+    return list(numbers)
+
+
+def parse_line_lists(texts) -> list:
+    """批量解析一份报告中所有漏洞的行号"""
+    return [parse_line_list(text) for text in texts]
+
+
+def parse_type_dict(text) -> dict:
+    """
+    解析 prompt2 返回的 {一级标题: 二级标题, ...}，容忍缺少引号、全角标点和多余文字
+
+    :return: 按出现顺序排列的字典，没有可识别的项时返回空字典
+    """
+    text = str(text)
+    start = text.find("{")
+    end = text.rfind("}")
+    if start != -1 and end > start:
+        text = text[start + 1:end]
+    result = {}
+    for groups in _DICT_PAIR.findall(text):
+        key = next((group for group in groups[:5] if group), "").strip()
+        value = next((group for group in groups[5:] if group), "").strip()
+        if key:
+            result[key] = value
+    return result
@@ -1,10 +1,21 @@
+import asyncio
 import os
-import aiofiles
 import logging
 from app.services.ai_content_service import parse_vulnerability_xml
 from app.services.ai_service import ark_ai_V3
-from app.cobra.cobra import cobra
 from app.services.data_validation import security_issues, type_verification, snippet_verification, get_line
+from app.services.diff_hunks import read_line_map
+from app.services.issue_classifier import issue_index, ISSUE_CLASSIFIER_THRESHOLD
+from app.services.audit_chunker import plan_chunks, render_chunk, estimate_chunk_tokens
+from app.services.line_index import LineIndex
+from app.services.llm_cache import llm_cache
+from app.services.cobra_scan import CobraScan, findings_in
+from app.services.output_parser import parse_type_dict
+from app.services.vuln_merge import merge_vulnerabilities
+from app.services.stream_parser import VulnerabilityStreamParser
+from app.services.metrics import metrics
+from app.services.quota import quota
+from app.models.database import async_get_db
 
 # 配置日志
 logging.basicConfig(
@@ -13,6 +24,16 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 单个文件同时审计的块数，以及单个 worker 进程内同时进行的 LLM 调用数
+FILE_CHUNK_CONCURRENCY = int(os.getenv("FILE_CHUNK_CONCURRENCY", "4"))
+WORKER_LLM_CONCURRENCY = int(os.getenv("WORKER_LLM_CONCURRENCY", "16"))
+_worker_llm_semaphore = asyncio.Semaphore(WORKER_LLM_CONCURRENCY)
+# 审计缓存键的组成部分：修改 audit_prompt 的内容后必须递增提示词版本，更换模型时修改 AUDIT_MODEL
+AUDIT_MODEL = os.getenv("AUDIT_MODEL", "ark_ai_V3")
+AUDIT_PROMPT_VERSION = "1"
+# 单次调用 token 数直方图的桶上限
+TOKEN_BUCKETS = (256, 1024, 4096, 8192, 16384, 32768, 65536, 131072)
+
 def add_report(report, report1):
     for key in report:
         if key == "language":
@@ -22,35 +43,8 @@ def add_report(report, report1):
             report[key] = report[key] + report1[key]
     return report
 
-async def process_R1_task(user_id, file_path):
-    full_path = os.path.join(f'file/{user_id}', file_path)
-    try:
-        cobra_list = await cobra(full_path)
-    except:
-        cobra_list = []
-    try:
-        async with aiofiles.open(full_path, 'r', encoding='utf-8') as f:
-            lines = await f.readlines()
-            numbered_lines = [f"{i + 1}: {line}" for i, line in enumerate(lines)]
-            content = ''.join(numbered_lines)
-            line_count = len(lines)
-        # logger.info(f"成功读取文件 {full_path}，行数: {line_count}")
-    except Exception as e:
-        logger.error(f'文件打开失败process: {e}')
-        return None, None, None
-
-    chunk_size = 102400
-    report = {"vulnerabilities": [],
-              "dependency_count": 0,
-              "issue_dependencies": 0,
-              "score": 0,
-              "language":''}
-    l = range(0, len(content), chunk_size)
-    ll = 0
-    total_tokens = (0, 0)
-    for i in l:
-        chunk = content[i:i + chunk_size]
-        prompt1 = f'''
+def audit_prompt(cobra_list, chunk):
+    return f'''
         你是一位代码审计安全专家，你的任务是对给定的代码进行全方位的深度检查。具体包括准确判断已检出的漏洞是否确实为漏洞，以及找出所有本地规则未涵盖的漏洞。
         <本地检测漏洞>
         {cobra_list}
@@ -101,36 +95,10 @@ async def process_R1_task(user_id, file_path):
         
         请按上述要求进行分析，严格按照格式输出，未发现漏洞则无需输出。
         '''
-        try:
-            response, total_token = await ark_ai_V3.get_response(prompt1, [], user_id)
-            total_tokens = tuple(x + y for x, y in zip(total_token, total_tokens))
-            report1 = await parse_vulnerability_xml(response)
-            if not report1["vulnerabilities"]:
-                ll += 1
-                report = add_report(report, report1)
-                continue
-            else:
-                snippet = []
-                ty = {}
-                for ii in report1["vulnerabilities"]:
-                    ty[ii["defect_type"]] = ii["defect_name"]
-                    snippet.append(ii['code_snippet'])
-                snippet = snippet_verification(snippet)
-                for index, value in enumerate(snippet):
-                    if not value:
-                        del report1["vulnerabilities"][index]
-                    else:
-                        start_line, end_line = get_line(value, line_count)
-                        code_lines = ''.join(numbered_lines[start_line: end_line])
-                        report1["vulnerabilities"][index]['code'] = code_lines
-                        hang_value = [hang for hang in value if start_line < hang <= end_line]
-                        report1["vulnerabilities"][index]['code_snippet'] = str(hang_value)
-        except Exception as e:
-            ll += 1
-            continue
 
 
-        prompt2 = f"""
+def classify_prompt(ty):
+    return f"""
         请帮我将一组分类匹配到指定的安全问题分类体系中。我提供的分类为：{ty}。
 请你按照下方的security_issues字典进行匹配，务必确保匹配后的一级标题是该字典的键，且对应的二级标题是该键所对应列表中的元素，不允许出现不在该字典中的一级标题或二级标题。
 security_issues字典如下：{security_issues}
@@ -138,28 +106,325 @@ security_issues字典如下：{security_issues}
 请你返回匹配后的结果，格式仍为{{一级标题:二级标题,一级标题:二级标题}}字典格式，并且顺序保持不变。
 注意：只需输出字典，无需输出其他多于内容！！！！！！
         """
-        try:
-            response, total_token = await ark_ai_V3.get_response(prompt2, [], None)
-            total_tokens = tuple(x + y for x, y in zip(total_token, total_tokens))
-            report2 = eval(response)
-            if len(report2) != len(ty):
-                ll += 1
-                # logger.warning(f"第 {i // chunk_size + 1} 个文件块解析报告为空，跳过")
+
+
+def add_tokens(total_tokens, total_token):
+    return tuple(x + y for x, y in zip(total_token, total_tokens))
+
+
+def record_llm_call(kind, total_token):
+    """记录一次 LLM 调用的 token 用量"""
+    metrics.inc("audit_llm_calls_total", prompt=kind)
+    for direction, count in zip(("input", "output"), total_token):
+        metrics.inc("audit_llm_tokens_total", count, prompt=kind, direction=direction)
+        metrics.observe("audit_llm_call_tokens", count, buckets=TOKEN_BUCKETS, prompt=kind, direction=direction)
+
+
+async def get_llm_response(prompt, user_id, kind="audit"):
+    """受 worker 级并发上限约束的 LLM 调用"""
+    with metrics.timer("llm_wait", prompt=kind):
+        await _worker_llm_semaphore.acquire()
+    try:
+        with metrics.timer("llm", prompt=kind):
+            response, total_token = await ark_ai_V3.get_response(prompt, [], user_id)
+    finally:
+        _worker_llm_semaphore.release()
+    record_llm_call(kind, total_token)
+    return response, total_token
+
+
+async def get_llm_stream(prompt, user_id, on_text, kind="audit"):
+    """
+    流式调用 LLM，每收到一段文本就交给 on_text，与 get_llm_response 共用并发上限与指标
+
+    ark_ai_V3.get_response_stream(prompt, history, user_id) 逐段产出文本，最后一项为
+    (输入 token, 输出 token)；未提供流式接口时退化为一次性调用，整段文本交给 on_text
+
+    :return: (完整响应, token 用量)
+    """
+    stream = getattr(ark_ai_V3, "get_response_stream", None)
+    if stream is None:
+        response, total_token = await get_llm_response(prompt, user_id, kind)
+        await on_text(response)
+        return response, total_token
+    parts = []
+    total_token = (0, 0)
+    with metrics.timer("llm_wait", prompt=kind):
+        await _worker_llm_semaphore.acquire()
+    try:
+        with metrics.timer("llm", prompt=kind):
+            async for item in stream(prompt, [], user_id):
+                if isinstance(item, tuple):
+                    total_token = item
+                    continue
+                parts.append(item)
+                await on_text(item)
+    finally:
+        _worker_llm_semaphore.release()
+    record_llm_call(kind, total_token)
+    return ''.join(parts), total_token
+
+
+def locate_vulnerability(vulnerability, value, numbered_lines, positions, line_count):
+    """
+    按校验后的行号截取漏洞所在代码窗口，写入 code 与 code_snippet
+
+    :param value: snippet_verification 得到的源文件行号列表
+    :return: 行号不在文件中时返回 False
+    """
+    rows = [positions[hang] for hang in value if hang in positions]
+    if not rows:
+        return False
+    start_line, end_line = get_line(rows, line_count)
+    vulnerability['code'] = ''.join(numbered_lines[start_line: end_line])
+    hang_value = [hang for hang in value if start_line < positions.get(hang, 0) <= end_line]
+    vulnerability['code_snippet'] = str(hang_value)
+    return True
+
+
+def classify_locally(vulnerability):
+    """本地索引归类，置信度足够时写入 category 与 type"""
+    category, name, score = issue_index.match(vulnerability["defect_type"], vulnerability["defect_name"])
+    if category and score >= ISSUE_CLASSIFIER_THRESHOLD:
+        vulnerability["category"] = category
+        vulnerability["type"] = name
+        return True
+    return False
+
+
+async def audit_chunk(chunk, cobra_list, user_id, numbered_lines, positions, line_count, on_vulnerability=None):
+    """
+    审计一个文件块：prompt1 检出漏洞，再归类到 security_issues
+
+    prompt1 的响应按代码块内容缓存，缓存命中的部分不计入返回的 token 用量
+
+    归类优先使用本地索引，只有置信度不足的漏洞才用 prompt2 交给 LLM
+
+    :param on_vulnerability: 可选的异步回调，响应中每完成一条漏洞就校验行号后以预览形式推送
+        （已截取代码，本地归类成功时带有 category 与 type）；块报告仍以完整响应的解析结果为准
+    :return: (块报告, token 用量, 是否计为失败)，块报告为 None 时不参与合并
+    """
+    tokens = (0, 0)
+    metrics.inc("audit_chunks_total")
+    parser = VulnerabilityStreamParser()
+
+    async def on_text(text):
+        if on_vulnerability is None:
+            return
+        for vulnerability in parser.feed(text):
+            value = snippet_verification([vulnerability['code_snippet']])[0]
+            if not locate_vulnerability(vulnerability, value, numbered_lines, positions, line_count):
                 continue
-            report2 = type_verification(report2)
-            items = list(report2.items())
-            for idx in range(len(items) - 1, -1, -1):
-                key, type_value = items[idx]
+            classify_locally(vulnerability)
+            metrics.inc("audit_streamed_findings_total")
+            try:
+                await on_vulnerability(vulnerability)
+            except Exception as e:
+                # 预览推送失败不影响审计本身
+                logger.warning(f"漏洞预览推送失败: {e}")
+
+    try:
+        # 相同代码块与本地检测结果的审计响应直接复用，命中时不计 token
+        cache_key = llm_cache.make_key(AUDIT_MODEL, AUDIT_PROMPT_VERSION, cobra_list, chunk)
+        response = await llm_cache.get(cache_key)
+        if response is None:
+            response, total_token = await get_llm_stream(audit_prompt(cobra_list, chunk), user_id, on_text)
+            tokens = add_tokens(tokens, total_token)
+            with metrics.timer("parse"):
+                report1 = await parse_vulnerability_xml(response)
+            await llm_cache.put(cache_key, response, total_token)
+        else:
+            await on_text(response)
+            with metrics.timer("parse"):
+                report1 = await parse_vulnerability_xml(response)
+        if not report1["vulnerabilities"]:
+            # 未发现漏洞是正常结果，单独计数，不计入失败率
+            metrics.inc("audit_chunks_clean_total")
+            return report1, tokens, True
+        snippet = snippet_verification([ii['code_snippet'] for ii in report1["vulnerabilities"]])
+        vulnerabilities = [
+            vulnerability
+            for vulnerability, value in zip(report1["vulnerabilities"], snippet)
+            if locate_vulnerability(vulnerability, value, numbered_lines, positions, line_count)
+        ]
+    except Exception as e:
+        metrics.inc("audit_chunk_failures_total", reason="audit_error", error=type(e).__name__)
+        return None, tokens, True
+
+    ty = {}
+    with metrics.timer("classify"):
+        for vulnerability in vulnerabilities:
+            if not classify_locally(vulnerability):
+                ty[vulnerability["defect_type"]] = vulnerability["defect_name"]
+    report1["vulnerabilities"] = vulnerabilities
+    if not ty:
+        return report1, tokens, False
+
+    def keep_local():
+        # prompt2 结果不可用时只丢弃交给 LLM 归类的漏洞，本地已归类的保留
+        report1["vulnerabilities"] = [vulnerability for vulnerability in vulnerabilities if "category" in vulnerability]
+        return report1, tokens, True
+
+    try:
+        response, total_token = await get_llm_response(classify_prompt(ty), None, kind="classify")
+        tokens = add_tokens(tokens, total_token)
+        report2 = parse_type_dict(response)
+        if len(report2) != len(ty):
+            metrics.inc("audit_chunk_failures_total", reason="classify_mismatch")
+            return keep_local()
+        # prompt2 要求按输入顺序返回 {一级标题: 二级标题}
+        llm_types = dict(zip(ty, type_verification(report2).items()))
+        classified = []
+        for vulnerability in vulnerabilities:
+            if "category" not in vulnerability:
+                key, type_value = llm_types[vulnerability["defect_type"]]
                 if not type_value:
-                    del report1["vulnerabilities"][idx]
+                    continue
+                vulnerability["category"] = key
+                vulnerability["type"] = type_value
+            classified.append(vulnerability)
+        report1["vulnerabilities"] = classified
+        return report1, tokens, False
+    except Exception as e:
+        metrics.inc("audit_chunk_failures_total", reason="classify_error", error=type(e).__name__)
+        logger.error(e)
+        return keep_local()
+
+
+async def process_R1_task(user_id, file_path, on_vulnerability=None):
+    """
+    审计单个文件
+
+    :param on_vulnerability: 可选的异步回调，各块生成过程中逐条推送漏洞预览，见 audit_chunk
+    :return: (行数, 报告, token 用量)
+    """
+    full_path = os.path.join(f'file/{user_id}', file_path)
+    # cobra 与读取文件并行，得到内容哈希后查询缓存
+    scan = CobraScan(full_path)
+    try:
+        # 文件通过 mmap 按需读取，只在内存中保留行偏移与正在审计的块
+        with metrics.timer("file_read"):
+            lines = await asyncio.to_thread(LineIndex, full_path)
+    except Exception as e:
+        scan.cancel()
+        metrics.inc("audit_file_failures_total", reason="open")
+        logger.error(f'文件打开失败process: {e}')
+        return None, None, None
+    metrics.inc("audit_files_total")
+    with lines:
+        with metrics.timer("file_hash"):
+            scan.use_content(await asyncio.to_thread(lines.digest))
+        # diff 模式的文件只包含变更区域，行号取自 webhook 写入的映射，与源文件一致
+        line_numbers = await read_line_map(user_id, file_path)
+        if line_numbers is not None and len(line_numbers) == len(lines):
+            lines.set_line_numbers(line_numbers)
+        # logger.info(f"成功读取文件 {full_path}，行数: {len(lines)}")
+        report, total_tokens = await audit_lines(user_id, full_path, lines, scan, on_vulnerability)
+    return len(lines), report, total_tokens
+
+
+async def audit_lines(user_id, full_path, lines, scan, on_vulnerability=None):
+    """
+    分块审计已打开的文件，块文本在获得并发名额后才生成
+
+    审计前按各块的估算用量预留当日 token 额度，超过上限时不审计；结束后按实际用量结算，
+    审计被取消或出错时退还预留
+
+    :param on_vulnerability: 漏洞预览回调，见 audit_chunk
+    :return: (报告, token 用量)，额度不足时报告为 None
+    """
+    numbered_lines = lines.numbered
+    # 源文件行号 -> numbered_lines 中的位置（从 1 开始）
+    positions = lines.positions
+    line_count = len(lines)
+    report = {"vulnerabilities": [],
+              "dependency_count": 0,
+              "issue_dependencies": 0,
+              "score": 0,
+              "language":''}
+    # 按行和估算 token 切块，尽量在函数、类边界处切分
+    with metrics.timer("chunking"):
+        chunks = plan_chunks(lines, numbered_lines)
+    reserved = estimate_chunk_tokens(lines, chunks)
+    async with async_get_db() as db:
+        allowed = await quota.reserve_tokens(db, user_id, reserved)
+        await db.commit()
+    if not allowed:
+        metrics.inc("audit_file_failures_total", reason="token_quota")
+        logger.warning(f"{full_path}: 用户 {user_id} 当日 token 额度不足，预估需要 {reserved}，跳过审计")
+        return None, (0, 0)
+    semaphore = asyncio.Semaphore(FILE_CHUNK_CONCURRENCY)
+
+    def audit(chunk, cobra_list, on_vulnerability=on_vulnerability):
+        return audit_chunk(chunk, cobra_list, user_id, numbered_lines, positions, line_count, on_vulnerability)
+
+    async def run(start, end, piece):
+        async with semaphore:
+            chunk = render_chunk(numbered_lines, start, end, piece)
+            if scan.done():
+                return await audit(chunk, findings_in(await scan.result(), start, end))
+            # cobra 未结束时先按无本地检测结果审计，扫描结束后该块若有检测结果则取消重审
+            # 推测审计的漏洞预览先暂存，确认保留该结果后再推送，丢弃时一并丢弃
+            held = []
+
+            async def hold(vulnerability):
+                if held is None:
+                    await on_vulnerability(vulnerability)
                 else:
-                    report1["vulnerabilities"][idx]["category"] = key
-                    report1["vulnerabilities"][idx]["type"] = type_value
-            report = add_report(report, report1)
-            # logger.info(f"成功处理第 {i // chunk_size + 1} 个文件块，更新报告")
-        except Exception as e:
-            logger.error(e)
+                    held.append(vulnerability)
+
+            speculative = asyncio.create_task(audit(chunk, [], hold if on_vulnerability else None))
+            try:
+                cobra_list = findings_in(await scan.result(), start, end)
+            except BaseException:
+                speculative.cancel()
+                raise
+            if not cobra_list:
+                previews, held = held, None
+                for vulnerability in previews:
+                    try:
+                        await on_vulnerability(vulnerability)
+                    except Exception as e:
+                        logger.warning(f"漏洞预览推送失败: {e}")
+                return await speculative
+            # 已经完成的推测审计丢弃结果，但其 token 已经计费，需计入用量
+            spent = (0, 0)
+            if speculative.done() and not speculative.cancelled() and speculative.exception() is None:
+                spent = speculative.result()[1]
+            else:
+                speculative.cancel()
+            metrics.inc("audit_chunk_retries_total", reason="cobra_findings")
+            report1, tokens, failed = await audit(chunk, cobra_list)
+            return report1, add_tokens(spent, tokens), failed
+
+    try:
+        results = await asyncio.gather(*(run(*chunk) for chunk in chunks))
+    except BaseException:
+        await settle_tokens(user_id, reserved, (0, 0))
+        raise
+    # 按块顺序合并，结果与串行审计一致
+    ll = 0
+    total_tokens = (0, 0)
+    for report1, tokens, failed in results:
+        total_tokens = add_tokens(total_tokens, tokens)
+        if failed:
             ll += 1
-            # logger.warning(f"第 {i // chunk_size + 1} 个文件块解析报告为空，跳过")
-            continue
-    return line_count, report, total_tokens
\ No newline at end of file
+        if report1 is not None:
+            report = add_report(report, report1)
+    if ll:
+        logger.info(f"{full_path}: {ll}/{len(chunks)} 个文件块未得到完整结果")
+    # 相邻块、重叠块对同一缺陷的重复报告合并为一条
+    with metrics.timer("merge"):
+        report["vulnerabilities"] = merge_vulnerabilities(report["vulnerabilities"], numbered_lines, positions, line_count)
+    await settle_tokens(user_id, reserved, total_tokens)
+    return report, total_tokens
+
+
+async def settle_tokens(user_id, reserved, total_tokens):
+    """在独立的会话中用实际用量替换预留量，结算失败只记录日志，不影响审计结果"""
+    try:
+        async with async_get_db() as db:
+            await quota.settle_tokens(db, user_id, reserved, *total_tokens)
+            await db.commit()
+    except Exception as e:
+        logger.error(f"token 用量结算失败 {user_id}: {e}")
\ No newline at end of file
@@ -0,0 +1,108 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+import aio_pika
+from aio_pika.exceptions import ChannelPreconditionFailed
+
+from app.services.fair_scheduler import MAX_PRIORITY
+
+logger = logging.getLogger(__name__)
+
+# 单轮流水线发布的最大消息数，超过后分轮等待 broker 确认
+PUBLISH_BATCH_SIZE = int(os.getenv("PUBLISH_BATCH_SIZE", "500"))
+# 带优先级的任务队列参数；已存在的队列不能修改参数，需用 migrate_queue.py 迁移
+TASK_QUEUE_ARGUMENTS = {"x-max-priority": MAX_PRIORITY}
+
+
+class PublishStats:
+    """批量发布的累计统计"""
+
+    def __init__(self):
+        self.batches = 0
+        self.messages = 0
+        self.failures = 0
+        self.seconds = 0.0
+
+    def record(self, messages: int, failures: int, seconds: float):
+        self.batches += 1
+        self.messages += messages
+        self.failures += failures
+        self.seconds += seconds
+
+    def snapshot(self):
+        return {
+            "batches": self.batches,
+            "messages": self.messages,
+            "failures": self.failures,
+            "seconds": self.seconds,
+            "messages_per_second": self.messages / self.seconds if self.seconds else 0.0,
+        }
+
+
+publish_stats = PublishStats()
+
+
+async def declare_task_queue(channel, name: str):
+    """
+    声明带 x-max-priority 的持久化任务队列，生产者与消费者都应通过它声明
+
+    队列已按旧参数存在时 broker 会拒绝声明并关闭通道，需先运行 migrate_queue.py
+    """
+    try:
+        return await channel.declare_queue(name, durable=True, arguments=TASK_QUEUE_ARGUMENTS)
+    except ChannelPreconditionFailed:
+        logger.error(f"队列 {name} 已存在且参数不同，请先运行 python migrate_queue.py {name}")
+        raise
+
+
+def build_task_message(user_id, git_type, issue_url, file_path, ACCESS_TOKEN, priority=None) -> aio_pika.Message:
+    """
+    构造一条持久化的文件审计任务消息
+
+    :param priority: 消息优先级，队列声明了 x-max-priority 时由 broker 按优先级投递
+    """
+    return aio_pika.Message(
+        body=json.dumps({
+            "user_id": user_id,
+            "git_type": git_type,
+            "issue_url": issue_url,
+            "file_path": file_path,
+            "access_token": ACCESS_TOKEN
+        }).encode(),
+        delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+        content_type="application/json",
+        priority=priority,
+    )
+
+
+async def publish_batch(channel, messages, routing_key: str):
+    """
+    流水线发布一批消息，每轮只等待一次 broker 确认
+
+    channel 需开启 publisher confirms（aio_pika 默认开启），否则结果只表示已写入连接。
+    发布请求按列表顺序写出，同一队列中的消息顺序与列表一致。
+
+    :param channel: aio_pika 通道
+    :param messages: aio_pika.Message 列表
+    :param routing_key: 目标队列
+    :return: 与 messages 顺序一致的结果列表，成功为 True，失败为对应异常
+    """
+    results = []
+    start = time.perf_counter()
+    exchange = channel.default_exchange
+    for i in range(0, len(messages), PUBLISH_BATCH_SIZE):
+        batch = messages[i:i + PUBLISH_BATCH_SIZE]
+        confirms = await asyncio.gather(
+            *(exchange.publish(message, routing_key=routing_key) for message in batch),
+            return_exceptions=True,
+        )
+        results.extend(c if isinstance(c, BaseException) else True for c in confirms)
+    failures = sum(1 for r in results if r is not True)
+    elapsed = time.perf_counter() - start
+    publish_stats.record(len(results), failures, elapsed)
+    if failures:
+        logger.warning(f"批量发布到 {routing_key}: {len(results)} 条中 {failures} 条失败")
+    return results
@@ -0,0 +1,144 @@
+import logging
+from datetime import date
+
+from sqlalchemy import case, func, insert, or_, update
+
+from app.config.settings import token_limit_default, chat_count_limit_default
+from app.models.models import TokenUsage
+
+logger = logging.getLogger(__name__)
+
+
+class QuotaService:
+    """
+    TokenUsage 的原子额度记账
+
+    预留额度是一条带条件的 UPDATE，由数据库保证并发下不超过上限，无需先读出记录再判断；
+    跨天的记录在同一条 UPDATE 中惰性重置。所有方法只执行语句，由调用方提交事务。
+    """
+
+    def __init__(self, chat_limit: int, token_limit: int):
+        self.chat_limit = chat_limit
+        self.token_limit = token_limit
+        self.stats = {
+            "chat_reserved": 0,
+            "chat_rejected": 0,
+            "chat_released": 0,
+            "token_reserved": 0,
+            "token_rejected": 0,
+        }
+
+    def _assignments(self, today: date, **deltas):
+        """
+        按 SET 顺序排列的赋值：跨天的记录先恢复默认值，再加上 deltas
+
+        MySQL 按从左到右的顺序执行 SET，后面的表达式会看到前面已更新的值，因此 expiration_date
+        必须最后赋值，前面的条件才能看到旧日期
+        """
+        expired = TokenUsage.expiration_date < today
+        defaults = (
+            (TokenUsage.chat_count, 0),
+            (TokenUsage.task_input_tokens, 0),
+            (TokenUsage.task_output_tokens, 0),
+            (TokenUsage.chat_count_limit, self.chat_limit),
+            (TokenUsage.token_limit, self.token_limit),
+        )
+        values = []
+        for column, default in defaults:
+            delta = deltas.get(column.key, 0)
+            values.append((column, case((expired, default + delta), else_=column + delta)))
+        values.append((TokenUsage.expiration_date, today))
+        return values
+
+    async def _insert(self, db, user_id: str, today: date, **values) -> bool:
+        """用户还没有记录时插入一条已计入本次用量的记录，并发插入时只有一个成功"""
+        result = await db.execute(
+            insert(TokenUsage).prefix_with("IGNORE").values(
+                user_id=user_id,
+                chat_count=values.get("chat_count", 0),
+                task_input_tokens=values.get("task_input_tokens", 0),
+                task_output_tokens=0,
+                chat_count_limit=self.chat_limit,
+                token_limit=self.token_limit,
+                expiration_date=today,
+            )
+        )
+        return result.rowcount == 1
+
+    async def reserve_chat(self, db, user_id: str) -> bool:
+        """
+        预留一次聊天次数
+
+        :return: 未超过当日上限时返回 True，次数已计入
+        """
+        today = date.today()
+        result = await db.execute(
+            update(TokenUsage)
+            .where(
+                TokenUsage.user_id == user_id,
+                or_(TokenUsage.expiration_date < today, TokenUsage.chat_count < TokenUsage.chat_count_limit),
+            )
+            .ordered_values(*self._assignments(today, chat_count=1))
+        )
+        if result.rowcount == 1 or await self._insert(db, user_id, today, chat_count=1):
+            self.stats["chat_reserved"] += 1
+            return True
+        self.stats["chat_rejected"] += 1
+        return False
+
+    async def release_chat(self, db, user_id: str):
+        """聊天未能完成时退还预留的次数；已跨天的预留随重置失效，不再退还"""
+        await db.execute(
+            update(TokenUsage)
+            .where(TokenUsage.user_id == user_id, TokenUsage.expiration_date == date.today())
+            .values(chat_count=func.greatest(TokenUsage.chat_count - 1, 0))
+        )
+        self.stats["chat_released"] += 1
+
+    async def reserve_tokens(self, db, user_id: str, tokens: int) -> bool:
+        """
+        按预估值预留 token 额度，预留量先计入 task_input_tokens，结束后用 settle_tokens 按实际用量修正
+
+        :return: 预留后不超过当日 token 上限时返回 True
+        """
+        if tokens <= 0:
+            return True
+        today = date.today()
+        used = TokenUsage.task_input_tokens + TokenUsage.task_output_tokens
+        conditions = [used + tokens <= TokenUsage.token_limit]
+        if tokens <= self.token_limit:
+            # 跨天的记录按重置后的默认上限判断
+            conditions.append(TokenUsage.expiration_date < today)
+        result = await db.execute(
+            update(TokenUsage)
+            .where(TokenUsage.user_id == user_id, or_(*conditions))
+            .ordered_values(*self._assignments(today, task_input_tokens=tokens))
+        )
+        if result.rowcount == 1 or (
+            tokens <= self.token_limit and await self._insert(db, user_id, today, task_input_tokens=tokens)
+        ):
+            self.stats["token_reserved"] += 1
+            return True
+        self.stats["token_rejected"] += 1
+        return False
+
+    async def settle_tokens(self, db, user_id: str, reserved: int, input_tokens: int, output_tokens: int):
+        """
+        用实际用量替换预留量；预留后已跨天的不再修正
+
+        :param reserved: reserve_tokens 预留的数量
+        """
+        await db.execute(
+            update(TokenUsage)
+            .where(TokenUsage.user_id == user_id, TokenUsage.expiration_date == date.today())
+            .values(
+                task_input_tokens=func.greatest(TokenUsage.task_input_tokens + (input_tokens - reserved), 0),
+                task_output_tokens=TokenUsage.task_output_tokens + output_tokens,
+            )
+        )
+
+    def snapshot(self):
+        return dict(self.stats)
+
+
+quota = QuotaService(chat_count_limit_default, token_limit_default)
@@ -0,0 +1,61 @@
+import re
+
+# <漏洞信息> 中的字段 -> 报告中漏洞的键，与 parse_vulnerability_xml 一致
+FIELD_MAP = {
+    "缺陷类型": "defect_type",
+    "缺陷名称": "defect_name",
+    "漏洞等级": "danger_level",
+    "漏洞概率": "probability",
+    "源代码行号": "code_snippet",
+    "风险分析": "defect_details",
+    "修复建议": "fix_suggestion",
+}
+
+BLOCK_OPEN = "<漏洞信息>"
+BLOCK_CLOSE = "</漏洞信息>"
+
+_BLOCK = re.compile(f"{BLOCK_OPEN}(.*?){BLOCK_CLOSE}", re.S)
+_FIELDS = {tag: re.compile(f"<{tag}>(.*?)</{tag}>", re.S) for tag in FIELD_MAP}
+
+
+def parse_block(block: str):
+    """解析单个 <漏洞信息> 块的内容，缺失的字段为空字符串"""
+    vulnerability = {}
+    for tag, key in FIELD_MAP.items():
+        match = _FIELDS[tag].search(block)
+        vulnerability[key] = match.group(1).strip() if match else ""
+    return vulnerability
+
+
+class VulnerabilityStreamParser:
+    """
+    增量解析 LLM 响应：每收到一个完整的 <漏洞信息> 块就返回一条漏洞
+
+    缓冲区只保留尚未结束的块，已解析的内容和块之外的文本不会累积。
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self.count = 0
+
+    def feed(self, text: str):
+        """
+        :param text: 新收到的响应片段
+        :return: 本次完成的漏洞列表
+        """
+        self._buffer += text
+        found = []
+        if BLOCK_CLOSE in self._buffer:
+            end = 0
+            for match in _BLOCK.finditer(self._buffer):
+                found.append(parse_block(match.group(1)))
+                end = match.end()
+            self._buffer = self._buffer[end:]
+        start = self._buffer.rfind(BLOCK_OPEN)
+        if start == -1:
+            # 保留可能被截断的起始标签
+            self._buffer = self._buffer[-(len(BLOCK_OPEN) - 1):]
+        else:
+            self._buffer = self._buffer[start:]
+        self.count += len(found)
+        return found
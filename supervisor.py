@@ -0,0 +1,233 @@
+import sys
+import os
+# 获取当前脚本所在的目录
+current_dir = os.path.dirname(os.path.abspath(__file__))
+# 获取项目根目录
+root_dir = os.path.dirname(current_dir)
+# 将项目根目录添加到系统路径
+sys.path.append(root_dir)
+import asyncio
+import importlib
+import json
+import logging
+import multiprocessing
+import re
+import signal
+import time
+import httpx
+from app.services.metrics import serve_http, CONTENT_TYPE
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+)
+logger = logging.getLogger(__name__)
+
+# 工作进程类型 -> (模块, 入口协程, 指标端口环境变量)
+WORKER_KINDS = {
+    "chat": ("app.RabbitMQ_chat", "run_consumer", "CHAT_METRICS_PORT"),
+    "ingest": ("app.ingest_worker", "run_ingest_consumer", None),
+    "audit": ("app.audit_worker", "run_audit_consumer", "AUDIT_METRICS_PORT"),
+}
+# 工作进程数，默认等于 CPU 核数
+SUPERVISOR_WORKERS = int(os.getenv("SUPERVISOR_WORKERS", "0")) or os.cpu_count() or 1
+# 监督进程汇总 /metrics 与 /health 的端口；第 i 个工作进程的指标端口为 WORKER_METRICS_BASE_PORT + i
+SUPERVISOR_PORT = int(os.getenv("SUPERVISOR_PORT", "9100"))
+WORKER_METRICS_BASE_PORT = int(os.getenv("WORKER_METRICS_BASE_PORT", "9110"))
+# 重启退避：连续崩溃时从 base 秒起每次翻倍，最多 max 秒；运行超过 stable 秒后退避清零
+RESTART_BACKOFF_BASE = float(os.getenv("RESTART_BACKOFF_BASE", "1"))
+RESTART_BACKOFF_MAX = float(os.getenv("RESTART_BACKOFF_MAX", "60"))
+WORKER_STABLE_SECONDS = float(os.getenv("WORKER_STABLE_SECONDS", "60"))
+# 退出时等待工作进程处理完消息的秒数，应大于 CHAT_SHUTDOWN_TIMEOUT 与 AUDIT_SHUTDOWN_TIMEOUT
+SUPERVISOR_STOP_TIMEOUT = float(os.getenv("SUPERVISOR_STOP_TIMEOUT", "75"))
+
+_SAMPLE = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{.*\})? (\S+)$")
+_HISTOGRAM_SUFFIXES = ("_bucket", "_sum", "_count")
+
+
+def run_worker(kind: str, index: int, metrics_port: int):
+    """工作进程入口：独立的事件循环、broker 连接与数据库连接池"""
+    module_name, entry, port_env = WORKER_KINDS[kind]
+    if port_env:
+        os.environ[port_env] = str(metrics_port)
+    module = importlib.import_module(module_name)
+    asyncio.run(getattr(module, entry)())
+
+
+def merge_metrics(texts):
+    """
+    合并多个进程的 Prometheus 文本：每个样本加上 worker 标签，同一指标族的样本放在一起
+
+    :param texts: [(worker, 文本)]
+    """
+    families = {}  # 指标族 -> (注释行, 样本行)
+    for worker, text in texts:
+        family = None
+        for line in text.splitlines():
+            if line.startswith("#"):
+                parts = line.split(" ", 3)
+                if len(parts) >= 3:
+                    family = parts[2]
+                    comments = families.setdefault(family, ([], []))[0]
+                    if line not in comments:
+                        comments.append(line)
+                continue
+            match = _SAMPLE.match(line)
+            if not match:
+                continue
+            name, labels, value = match.groups()
+            if family is None or (name != family and name not in [family + suffix for suffix in _HISTOGRAM_SUFFIXES]):
+                family = None
+                key = name
+            else:
+                key = family
+            worker_label = f'worker="{worker}"'
+            labels = "{" + worker_label + ("," + labels[1:] if labels else "}")
+            families.setdefault(key, ([], []))[1].append(f"{name}{labels} {value}")
+    lines = []
+    for comments, samples in families.values():
+        lines.extend(comments)
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+class WorkerSlot:
+    """一个工作进程位置：崩溃后在同一位置按退避重启"""
+
+    def __init__(self, kind: str, index: int):
+        self.kind = kind
+        self.index = index
+        self.metrics_port = WORKER_METRICS_BASE_PORT + index
+        self.process = None
+        self.started_at = 0.0
+        self.restarts = 0
+        self.failures = 0
+        self.restart_at = None
+
+    def start(self, context):
+        self.process = context.Process(
+            target=run_worker,
+            args=(self.kind, self.index, self.metrics_port),
+            name=f"{self.kind}-worker-{self.index}",
+        )
+        self.process.start()
+        self.started_at = time.monotonic()
+        self.restart_at = None
+        logger.info(f"启动工作进程 {self.process.name} pid={self.process.pid}")
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def schedule_restart(self):
+        """进程退出后计算下次启动时间"""
+        if time.monotonic() - self.started_at >= WORKER_STABLE_SECONDS:
+            self.failures = 0
+        self.failures += 1
+        delay = min(RESTART_BACKOFF_BASE * 2 ** (self.failures - 1), RESTART_BACKOFF_MAX)
+        self.restart_at = time.monotonic() + delay
+        logger.warning(
+            f"工作进程 {self.process.name} 退出 exitcode={self.process.exitcode}，{delay:.0f} 秒后重启"
+        )
+
+    def status(self):
+        return {
+            "worker": self.index,
+            "pid": self.process.pid if self.process else None,
+            "alive": self.alive,
+            "restarts": self.restarts,
+            "uptime_seconds": time.monotonic() - self.started_at if self.alive else 0,
+        }
+
+
+class Supervisor:
+    """启动并监督 K 个工作进程，汇总它们的健康状态与指标"""
+
+    def __init__(self, kind: str, count: int):
+        self.kind = kind
+        self.slots = [WorkerSlot(kind, i) for i in range(count)]
+        # spawn 方式启动，子进程不继承父进程的连接与事件循环
+        self.context = multiprocessing.get_context("spawn")
+        self.stopping = asyncio.Event()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self.stopping.set)
+        server = await serve_http(SUPERVISOR_PORT, {"/metrics": self.metrics, "/health": self.health})
+        logger.info(f"监督进程启动 {len(self.slots)} 个 {self.kind} 工作进程，端口 {SUPERVISOR_PORT}")
+        for slot in self.slots:
+            slot.start(self.context)
+        try:
+            await self.monitor()
+        finally:
+            server.close()
+            await self.stop()
+
+    async def monitor(self):
+        while not self.stopping.is_set():
+            now = time.monotonic()
+            for slot in self.slots:
+                if slot.alive:
+                    continue
+                if slot.restart_at is None:
+                    slot.schedule_restart()
+                elif now >= slot.restart_at:
+                    slot.restarts += 1
+                    slot.start(self.context)
+            try:
+                await asyncio.wait_for(self.stopping.wait(), timeout=1)
+            except asyncio.TimeoutError:
+                pass
+
+    async def stop(self):
+        """发送 SIGTERM 让工作进程优雅退出，超时后强制结束"""
+        for slot in self.slots:
+            if slot.alive:
+                slot.process.terminate()
+        deadline = time.monotonic() + SUPERVISOR_STOP_TIMEOUT
+        while any(slot.alive for slot in self.slots) and time.monotonic() < deadline:
+            await asyncio.sleep(0.5)
+        for slot in self.slots:
+            if slot.alive:
+                logger.warning(f"工作进程 {slot.process.name} 未在超时内退出，强制结束")
+                slot.process.kill()
+                slot.process.join()
+        logger.info("所有工作进程已退出")
+
+    async def health(self):
+        workers = [slot.status() for slot in self.slots]
+        status = 200 if all(worker["alive"] for worker in workers) else 503
+        return status, "application/json", json.dumps({"kind": self.kind, "workers": workers})
+
+    async def metrics(self):
+        own = ["# TYPE supervisor_worker_up gauge", "# TYPE supervisor_worker_restarts_total counter"]
+        for slot in self.slots:
+            own.append(f'supervisor_worker_up{{worker="{slot.index}"}} {int(slot.alive)}')
+            own.append(f'supervisor_worker_restarts_total{{worker="{slot.index}"}} {slot.restarts}')
+        texts = []
+        if WORKER_KINDS[self.kind][2]:
+            async with httpx.AsyncClient(timeout=2) as client:
+
+                async def fetch(slot):
+                    try:
+                        response = await client.get(f"http://127.0.0.1:{slot.metrics_port}/metrics")
+                        response.raise_for_status()
+                        return slot.index, response.text
+                    except httpx.HTTPError as e:
+                        logger.warning(f"获取工作进程 {slot.index} 指标失败: {e}")
+                        return None
+
+                results = await asyncio.gather(*(fetch(slot) for slot in self.slots if slot.alive))
+            texts = [result for result in results if result is not None]
+        return 200, CONTENT_TYPE, "\n".join(own) + "\n" + merge_metrics(texts)
+
+
+# 主程序入口：python supervisor.py [chat|ingest|audit] [进程数]
+if __name__ == "__main__":
+    worker_kind = sys.argv[1] if len(sys.argv) > 1 else "chat"
+    worker_count = int(sys.argv[2]) if len(sys.argv) > 2 else SUPERVISOR_WORKERS
+    if worker_kind not in WORKER_KINDS:
+        sys.exit(f"未知的工作进程类型 {worker_kind}，可选: {', '.join(WORKER_KINDS)}")
+    asyncio.run(Supervisor(worker_kind, worker_count).run())
@@ -0,0 +1,80 @@
+import unittest
+
+from app.services.audit_chunker import (
+    LINE_PREFIX_TOKENS,
+    MAX_CHUNK_CHARS,
+    estimate_tokens,
+    plan_chunks,
+    render_chunk,
+    split_lines,
+)
+
+
+def numbered(lines):
+    return [f"{i + 1}: {line}" for i, line in enumerate(lines)]
+
+
+def cost(lines, start, end):
+    return sum(estimate_tokens(line) + LINE_PREFIX_TOKENS for line in lines[start:end])
+
+
+class SplitLinesTest(unittest.TestCase):
+    """split_lines 在预算内按行切分，优先在声明边界切分"""
+
+    def test_ranges_cover_file_within_budget(self):
+        lines = [f"    x = {i}\n" for i in range(100)]
+        ranges = split_lines(lines, budget=50, overlap=0)
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], len(lines))
+        for (start, end), (next_start, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(end, next_start)
+        for start, end in ranges:
+            self.assertLessEqual(cost(lines, start, end), 50)
+
+    def test_prefers_declaration_boundary(self):
+        lines = ["def a():\n"] + ["    a = 1\n"] * 5 + ["def b():\n"] + ["    b = 2\n"] * 5
+        ranges = split_lines(lines, budget=cost(lines, 0, 9), overlap=0)
+        self.assertEqual(ranges[0], (0, 6))
+
+    def test_overlap(self):
+        lines = [f"    x = {i}\n" for i in range(40)]
+        ranges = split_lines(lines, budget=30, overlap=2)
+        for (start, end), (next_start, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(next_start, end - 2)
+
+    def test_line_over_budget_is_own_chunk(self):
+        lines = ["a\n", "x" * 1000 + "\n", "b\n"]
+        self.assertEqual(split_lines(lines, budget=20, overlap=0), [(0, 1), (1, 2), (2, 3)])
+
+    def test_empty_file(self):
+        self.assertEqual(split_lines([], budget=20), [])
+
+
+class PlanChunksTest(unittest.TestCase):
+    def test_whole_chunks_render_all_lines(self):
+        lines = [f"    x = {i}\n" for i in range(30)]
+        numbered_lines = numbered(lines)
+        chunks = plan_chunks(lines, numbered_lines, budget=40, overlap=0)
+        self.assertTrue(all(piece is None for _, _, piece in chunks))
+        text = "".join(render_chunk(numbered_lines, *chunk) for chunk in chunks)
+        self.assertEqual(text, "".join(numbered_lines))
+
+    def test_long_line_is_split_by_characters(self):
+        lines = ["a\n", "x" * (MAX_CHUNK_CHARS * 2 + 10) + "\n"]
+        numbered_lines = numbered(lines)
+        chunks = plan_chunks(lines, numbered_lines, budget=100, overlap=0)
+        pieces = [chunk for chunk in chunks if chunk[2] is not None]
+        self.assertEqual(len(pieces), 3)
+        self.assertTrue(all(start == 1 and end == 2 for start, end, _ in pieces))
+        self.assertEqual("".join(render_chunk(numbered_lines, *chunk) for chunk in pieces), numbered_lines[1])
+        self.assertTrue(all(len(render_chunk(numbered_lines, *chunk)) <= MAX_CHUNK_CHARS for chunk in pieces))
+
+
+class EstimateTokensTest(unittest.TestCase):
+    def test_ascii_and_cjk(self):
+        self.assertEqual(estimate_tokens("abcdefgh"), 3)
+        self.assertEqual(estimate_tokens("中文"), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
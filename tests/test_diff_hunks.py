@@ -0,0 +1,84 @@
+import unittest
+
+from app.services.diff_hunks import HUNK_SEPARATOR, HunkBuilder, get_file_hunks
+
+DIFF = """\
+diff --git a/a.py b/a.py
+@@ -1,7 +1,8 @@
+ line1
+ line2
+ line3
+-old4
++new4
++new5
+ line6
+ line7
+ line8
+@@ -40,3 +41,4 @@ def f():
+ line41
++new42
+ line43
+"""
+
+
+class HunkBuilderTest(unittest.TestCase):
+    """HunkBuilder 按 hunk 头记录新文件行号，删除行不占行号"""
+
+    def feed(self, diff):
+        builder = HunkBuilder()
+        for line in diff.splitlines():
+            builder.feed(line)
+        return builder
+
+    def test_new_file_line_numbers(self):
+        builder = self.feed(DIFF)
+        self.assertEqual(len(builder.hunks), 2)
+        self.assertEqual(
+            [(number, added) for number, _, added in builder.hunks[0]],
+            [(1, False), (2, False), (3, False), (4, True), (5, True), (6, False), (7, False), (8, False)],
+        )
+        self.assertEqual(builder.hunks[1], [(41, "line41", False), (42, "new42", True), (43, "line43", False)])
+
+    def test_lines_before_first_header_are_ignored(self):
+        builder = self.feed("+++ b/a.py\n+not in a hunk\n")
+        self.assertEqual(builder.hunks, [])
+        self.assertFalse(builder.has_changes)
+
+    def test_deletion_only_has_no_changes(self):
+        builder = self.feed("@@ -1,3 +1,2 @@\n a\n-b\n c\n")
+        self.assertFalse(builder.has_changes)
+        self.assertEqual([number for number, _, _ in builder.hunks[0]], [1, 2])
+
+    def test_no_newline_marker_takes_no_line(self):
+        builder = self.feed("@@ -1 +1 @@\n-a\n\\ No newline at end of file\n+b\n")
+        self.assertEqual(builder.hunks[0], [(1, "b", True)])
+
+    def test_empty_context_line(self):
+        # 部分平台会去掉空白上下文行的前导空格
+        builder = self.feed("@@ -1,3 +1,3 @@\n a\n\n+c\n")
+        self.assertEqual(builder.hunks[0], [(1, "a", False), (2, "", False), (3, "c", True)])
+
+
+class RenderTest(unittest.TestCase):
+    def test_context_and_separator(self):
+        text, numbers = get_file_hunks(DIFF, context=1)
+        self.assertEqual(numbers, [3, 4, 5, 6, None, 41, 42, 43])
+        self.assertEqual(text.splitlines(), ["line3", "new4", "new5", "line6", HUNK_SEPARATOR, "line41", "new42", "line43"])
+
+    def test_overlapping_context_is_not_duplicated(self):
+        text, numbers = get_file_hunks("@@ -1,3 +1,4 @@\n+a\n b\n+c\n d\n", context=3)
+        self.assertEqual(numbers, [1, 2, 3, 4])
+
+    def test_zero_context_keeps_only_added_lines(self):
+        text, numbers = get_file_hunks(DIFF, context=0)
+        self.assertEqual(numbers, [4, 5, None, 42])
+        self.assertEqual(text, f"new4\nnew5\n{HUNK_SEPARATOR}\nnew42\n")
+
+    def test_adjacent_hunks_have_no_separator(self):
+        diff = "@@ -1,1 +1,2 @@\n a\n+b\n@@ -2,1 +3,2 @@\n c\n+d\n"
+        text, numbers = get_file_hunks(diff, context=1)
+        self.assertEqual(numbers, [1, 2, 3, 4])
+
+
+if __name__ == "__main__":
+    unittest.main()
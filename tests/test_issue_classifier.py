@@ -0,0 +1,77 @@
+import unittest
+
+from app.services.issue_classifier import ISSUE_CLASSIFIER_THRESHOLD, IssueIndex, issue_index, synonym_pattern
+
+TAXONOMY = {
+    "数据库管理": ["SQL 注入", "及时释放数据库资源"],
+    "输入验证": ["命令行注入", "除零错误"],
+    "文件管理": ["SQL 注入"],
+}
+SYNONYMS = {
+    "sql injection": ("数据库管理", "SQL 注入"),
+    "xss": ("输入验证", "命令行注入"),
+}
+
+
+class IssueIndexMatchTest(unittest.TestCase):
+    """IssueIndex.match 的四级匹配与置信度"""
+
+    def setUp(self):
+        self.index = IssueIndex(TAXONOMY, SYNONYMS)
+
+    def test_exact_pair(self):
+        self.assertEqual(self.index.match("输入验证", "除零错误"), ("输入验证", "除零错误", 1.0))
+
+    def test_normalized_name_prefers_given_category(self):
+        # 全角、大小写与空白不同的同名二级标题，优先归入模型给出的一级标题
+        self.assertEqual(self.index.match("文件管理", "ｓｑｌ注入"), ("文件管理", "SQL 注入", 0.95))
+        self.assertEqual(self.index.match("未知", "sql注入"), ("数据库管理", "SQL 注入", 0.95))
+
+    def test_synonym_covering_name(self):
+        self.assertEqual(self.index.match("注入", "SQL Injection漏洞"), ("数据库管理", "SQL 注入", 0.9))
+
+    def test_synonym_without_space_between_words(self):
+        category, name, score = self.index.match("", "SQLInjection")
+        self.assertEqual((category, name, score), ("数据库管理", "SQL 注入", 0.9))
+
+    def test_synonym_in_long_name_is_low_confidence(self):
+        category, name, score = self.index.match("", "possible sql injection through unsanitized request parameters")
+        self.assertEqual((category, name), ("数据库管理", "SQL 注入"))
+        self.assertLess(score, ISSUE_CLASSIFIER_THRESHOLD)
+
+    def test_synonym_needs_word_boundary(self):
+        category, name, score = self.index.match("", "xssfilter misconfigured")
+        self.assertNotEqual(name, "命令行注入")
+        self.assertLess(score, ISSUE_CLASSIFIER_THRESHOLD)
+
+    def test_ngram_fallback(self):
+        category, name, score = self.index.match("输入验证", "除零")
+        self.assertEqual((category, name), ("输入验证", "除零错误"))
+        self.assertLess(score, ISSUE_CLASSIFIER_THRESHOLD)
+
+    def test_no_match(self):
+        self.assertEqual(self.index.match("", "unrelated"), (None, None, 0.0))
+
+
+class SecurityIssuesIndexTest(unittest.TestCase):
+    """基于 security_issues 的全局索引对模型常见说法的归类"""
+
+    def assertClassified(self, defect_type, defect_name, expected):
+        category, name, score = issue_index.match(defect_type, defect_name)
+        self.assertEqual((category, name), expected)
+        self.assertGreaterEqual(score, ISSUE_CLASSIFIER_THRESHOLD)
+
+    def test_common_names(self):
+        self.assertClassified("注入", "SQL注入漏洞", ("数据库管理", "SQL 注入"))
+        self.assertClassified("安全", "使用了不安全的随机数生成器", ("输出编码", "随机数安全"))
+
+    def test_synonyms_for_same_target_add_up(self):
+        self.assertClassified("跨站", "跨站脚本攻击(XSS)", ("输入验证", "对HTTP头Web脚本特殊元素处理"))
+
+    def test_synonym_pattern(self):
+        self.assertTrue(synonym_pattern("use after free").search("heap use after free"))
+        self.assertIsNone(synonym_pattern("md5").search("md5sum"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import hashlib
+import os
+import tempfile
+import unittest
+
+from app.services import line_index
+from app.services.line_index import LineIndex
+
+
+class LineIndexTest(unittest.TestCase):
+    """LineIndex 与文本模式 readlines 的结果一致，并严格按 UTF-8 解码"""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def write(self, data: bytes) -> str:
+        path = os.path.join(self.dir.name, "a.py")
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_matches_readlines(self):
+        data = "第一行\r\nsecond\n\nlast without newline".encode()
+        path = self.write(data)
+        with open(path, encoding="utf-8") as f:
+            expected = f.readlines()
+        with LineIndex(path) as lines:
+            self.assertEqual(len(lines), len(expected))
+            self.assertEqual([lines[i] for i in range(len(lines))], expected)
+            self.assertEqual(lines.digest(), hashlib.sha256(data).hexdigest())
+
+    def test_empty_file(self):
+        with LineIndex(self.write(b"")) as lines:
+            self.assertEqual(len(lines), 0)
+            self.assertEqual(lines.numbered[:], [])
+
+    def test_numbered_lines(self):
+        with LineIndex(self.write(b"a\nb\nc\n")) as lines:
+            self.assertEqual(lines.numbered[1], "2: b\n")
+            self.assertEqual(lines.numbered[-1], "3: c\n")
+            self.assertEqual(lines.numbered[0:2], ["1: a\n", "2: b\n"])
+            self.assertEqual(lines.positions[3], 3)
+            self.assertNotIn(4, lines.positions)
+
+    def test_diff_line_numbers(self):
+        with LineIndex(self.write(b"x\n...\ny\n")) as lines:
+            lines.set_line_numbers([10, None, 20])
+            self.assertEqual(lines.numbered[:], ["10: x\n", "...\n", "20: y\n"])
+            self.assertEqual(lines.positions, {10: 1, 20: 3})
+
+    def test_invalid_utf8_fails_at_open(self):
+        with self.assertRaises(UnicodeDecodeError):
+            LineIndex(self.write(b"ok\n\xff\xfe\n"))
+
+    def test_multibyte_char_across_validate_blocks(self):
+        # 多字节字符跨越校验块边界时不能误判为无法解码
+        original = line_index.VALIDATE_BLOCK
+        line_index.VALIDATE_BLOCK = 4
+        self.addCleanup(setattr, line_index, "VALIDATE_BLOCK", original)
+        with LineIndex(self.write("ab中文\n".encode())) as lines:
+            self.assertEqual(lines[0], "ab中文\n")
+
+    def test_truncated_multibyte_char_at_end_fails(self):
+        with self.assertRaises(UnicodeDecodeError):
+            LineIndex(self.write("中".encode()[:2]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+
+from app.services.output_parser import MAX_RANGE_LINES, parse_line_list, parse_line_lists, parse_type_dict
+
+
+class ParseLineListsTest(unittest.TestCase):
+    """模型给出的行号按文本解析，不执行任何代码"""
+
+    def test_list_literal(self):
+        self.assertEqual(parse_line_lists(["[1]", "[1, 2, 3]", "[]"]), [[1], [1, 2, 3], []])
+
+    def test_full_width_and_ranges(self):
+        self.assertEqual(parse_line_list("［３，５］"), [3, 5])
+        self.assertEqual(parse_line_list("12-14"), [12, 13, 14])
+        self.assertEqual(parse_line_list("第12行至第14行"), [12, 13, 14])
+        self.assertEqual(parse_line_list("1～2；5"), [1, 2, 5])
+
+    def test_duplicates_keep_first_order(self):
+        self.assertEqual(parse_line_list("[5, 3, 5, 4-6]"), [5, 3, 4, 6])
+
+    def test_huge_or_reversed_range_keeps_endpoints(self):
+        self.assertEqual(parse_line_list(f"1-{MAX_RANGE_LINES + 1}"), [1, MAX_RANGE_LINES + 1])
+        self.assertEqual(parse_line_list("9-3"), [9, 3])
+
+    def test_non_string_input(self):
+        self.assertEqual(parse_line_list([7, "8"]), [7, 8])
+        self.assertEqual(parse_line_list(12), [12])
+
+    def test_unparseable_and_code_are_not_executed(self):
+        self.assertEqual(parse_line_list("无"), [])
+        self.assertEqual(parse_line_list("__import__('os').system('true')"), [])
+
+
+class ParseTypeDictTest(unittest.TestCase):
+    def test_python_dict(self):
+        text = "{'输入验证': '命令行注入', '数据库管理': 'SQL 注入'}"
+        self.assertEqual(list(parse_type_dict(text).items()), [("输入验证", "命令行注入"), ("数据库管理", "SQL 注入")])
+
+    def test_surrounding_text_and_mixed_quotes(self):
+        text = '结果如下：\n```\n{“输入验证”：“除零错误”, "资源管理": 无限循环}\n```'
+        self.assertEqual(parse_type_dict(text), {"输入验证": "除零错误", "资源管理": "无限循环"})
+
+    def test_unquoted_pairs(self):
+        self.assertEqual(parse_type_dict("{输入验证:除零错误，口令安全:登录口令}"), {"输入验证": "除零错误", "口令安全": "登录口令"})
+
+    def test_no_pairs(self):
+        self.assertEqual(parse_type_dict("无法匹配"), {})
+        self.assertEqual(parse_type_dict(""), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
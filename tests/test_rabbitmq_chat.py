@@ -0,0 +1,77 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+from app import RabbitMQ_chat
+from app.models.models import TaskStatus
+
+
+def make_task():
+    task = SimpleNamespace(id=1, session_task_id="s1", user_id="u1", status=TaskStatus.PENDING)
+    file1 = SimpleNamespace(callback_chat_url="http://callback/chat")
+    return task, file1
+
+
+class ProcessFileContentQuotaTest(unittest.IsolatedAsyncioTestCase):
+    """process_file_content 只在预留已提交后才退还聊天次数"""
+
+    def setUp(self):
+        self.quota = SimpleNamespace(reserve_chat=AsyncMock(return_value=True), release_chat=AsyncMock())
+        self.chat_flow = AsyncMock(return_value="ok")
+        patches = [
+            patch.object(RabbitMQ_chat, "quota", self.quota),
+            patch.object(RabbitMQ_chat, "chat_flow", self.chat_flow),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.db = AsyncMock()
+
+    async def test_first_commit_failure_does_not_release(self):
+        # 预留与处理中状态的提交失败：回滚已撤销预留，退还会少计其它聊天的次数
+        self.db.commit.side_effect = [RuntimeError("commit failed"), None]
+        task, file1 = make_task()
+        await RabbitMQ_chat.process_file_content(self.db, task, file1, "u1", "a.py")
+        self.db.rollback.assert_awaited_once()
+        self.quota.release_chat.assert_not_awaited()
+        self.chat_flow.assert_not_awaited()
+        self.assertEqual(self.db.commit.await_count, 2)
+
+    async def test_chat_failure_after_commit_releases(self):
+        self.chat_flow.side_effect = RuntimeError("chat failed")
+        task, file1 = make_task()
+        await RabbitMQ_chat.process_file_content(self.db, task, file1, "u1", "a.py")
+        self.quota.release_chat.assert_awaited_once_with(self.db, "u1")
+
+    async def test_completed_chat_keeps_reservation(self):
+        task, file1 = make_task()
+        await RabbitMQ_chat.process_file_content(self.db, task, file1, "u1", "a.py")
+        self.chat_flow.assert_awaited_once()
+        self.quota.release_chat.assert_not_awaited()
+        self.db.rollback.assert_not_awaited()
+
+    async def test_cancelled_chat_releases_and_resets(self):
+        # drain 超时取消处理中的聊天：退还次数，状态改回待处理，取消继续向上抛出
+        self.chat_flow.side_effect = asyncio.CancelledError()
+        task, file1 = make_task()
+        with patch.object(RabbitMQ_chat, "update_task_status", AsyncMock()) as update_status:
+            with self.assertRaises(asyncio.CancelledError):
+                await RabbitMQ_chat.process_file_content(self.db, task, file1, "u1", "a.py")
+        self.quota.release_chat.assert_awaited_once_with(self.db, "u1")
+        update_status.assert_awaited_once_with(self.db, RabbitMQ_chat.Task, 1, TaskStatus.PENDING)
+        self.assertEqual(self.db.commit.await_count, 2)
+
+    async def test_rejected_chat_does_not_release(self):
+        self.quota.reserve_chat.return_value = False
+        task, file1 = make_task()
+        with patch.object(RabbitMQ_chat, "callback_dispatcher") as dispatcher:
+            await RabbitMQ_chat.process_file_content(self.db, task, file1, "u1", "a.py")
+        # 超限通知按聊天会话排队，不同会话共用回调地址时互不阻塞
+        self.assertEqual({call.args[2] for call in dispatcher.send.call_args_list}, {"s1"})
+        self.chat_flow.assert_not_awaited()
+        self.quota.release_chat.assert_not_awaited()
+
+
+if __name__ == "__main__":
+    unittest.main()
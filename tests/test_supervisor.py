@@ -0,0 +1,59 @@
+import unittest
+
+from app.supervisor import merge_metrics
+
+WORKER_0 = """\
+# HELP chat_messages_total Chat messages
+# TYPE chat_messages_total counter
+chat_messages_total 3
+# TYPE audit_stage_seconds histogram
+audit_stage_seconds_bucket{stage="llm",le="1"} 1
+audit_stage_seconds_bucket{stage="llm",le="+Inf"} 2
+audit_stage_seconds_sum{stage="llm"} 3.5
+audit_stage_seconds_count{stage="llm"} 2
+chat_quota_chat_reserved 4
+"""
+
+WORKER_1 = """\
+# HELP chat_messages_total Chat messages
+# TYPE chat_messages_total counter
+chat_messages_total 5
+chat_quota_chat_reserved 1
+"""
+
+
+class MergeMetricsTest(unittest.TestCase):
+    """merge_metrics 给每个样本加上 worker 标签，并把同一指标族的样本放在一起"""
+
+    def setUp(self):
+        self.lines = merge_metrics([(0, WORKER_0), (1, WORKER_1)]).splitlines()
+
+    def test_worker_label(self):
+        self.assertIn('chat_messages_total{worker="0"} 3', self.lines)
+        self.assertIn('chat_messages_total{worker="1"} 5', self.lines)
+        self.assertIn('audit_stage_seconds_bucket{worker="0",stage="llm",le="+Inf"} 2', self.lines)
+
+    def test_comments_are_not_repeated(self):
+        self.assertEqual(self.lines.count("# TYPE chat_messages_total counter"), 1)
+        self.assertEqual(self.lines.count("# HELP chat_messages_total Chat messages"), 1)
+
+    def test_family_samples_follow_their_comments(self):
+        start = self.lines.index("# TYPE chat_messages_total counter")
+        self.assertEqual(
+            self.lines[start + 1:start + 3],
+            ['chat_messages_total{worker="0"} 3', 'chat_messages_total{worker="1"} 5'],
+        )
+        start = self.lines.index("# TYPE audit_stage_seconds histogram")
+        self.assertEqual(self.lines[start + 4], 'audit_stage_seconds_count{worker="0",stage="llm"} 2')
+
+    def test_untyped_samples_are_grouped(self):
+        # collector 输出的样本没有注释行，按名称归为一组
+        start = self.lines.index('chat_quota_chat_reserved{worker="0"} 4')
+        self.assertEqual(self.lines[start + 1], 'chat_quota_chat_reserved{worker="1"} 1')
+
+    def test_invalid_lines_are_skipped(self):
+        self.assertEqual(merge_metrics([(0, "not a sample line\n")]), "\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+
+from app.services.output_parser import parse_line_list
+from app.services.vuln_merge import VULN_MERGE_MAX_SPAN, VULN_MERGE_MAX_WINDOW, IntervalIndex, line_runs, merge_vulnerabilities
+
+LINE_COUNT = 1000
+NUMBERED_LINES = [f"{i}: code\n" for i in range(1, LINE_COUNT + 1)]
+POSITIONS = {i: i for i in range(1, LINE_COUNT + 1)}
+
+
+def finding(lines, danger_level="中危", probability="50", category="数据库管理", type="SQL 注入"):
+    return {
+        "category": category,
+        "type": type,
+        "code_snippet": str(lines),
+        "danger_level": danger_level,
+        "probability": probability,
+    }
+
+
+def merge(vulnerabilities):
+    return merge_vulnerabilities(vulnerabilities, NUMBERED_LINES, POSITIONS, LINE_COUNT)
+
+
+class IntervalIndexTest(unittest.TestCase):
+    def test_overlapping_and_adjacent(self):
+        index = IntervalIndex()
+        index.add(10, 20, 0)
+        index.add(30, 30, 1)
+        index.add(5, 100, 2)
+        self.assertEqual(index.overlapping(21, 25), {0, 2})
+        self.assertEqual(index.overlapping(31, 31), {1, 2})
+        self.assertEqual(index.overlapping(102, 110), set())
+        self.assertEqual(index.overlapping(101, 101), {2})
+
+    def test_long_interval_found_from_far_right(self):
+        # 起点很靠左的长区间也要被找到
+        index = IntervalIndex()
+        index.add(1, 500, 0)
+        for i in range(100, 400, 10):
+            index.add(i, i, i)
+        self.assertIn(0, index.overlapping(450, 460))
+
+    def test_line_runs(self):
+        self.assertEqual(line_runs([5, 3, 4, 9, 9, 10]), [(3, 5), (9, 10)])
+        self.assertEqual(line_runs([]), [])
+
+
+class MergeVulnerabilitiesTest(unittest.TestCase):
+    def test_duplicates_keep_most_severe(self):
+        merged = merge([finding([100, 105]), finding([103, 106], "高危", "80"), finding([300])])
+        self.assertEqual(len(merged), 2)
+        self.assertEqual(merged[0]["danger_level"], "高危")
+        self.assertEqual(merged[0]["code_snippet"], "[100, 103, 105, 106]")
+        self.assertIn("100: code", merged[0]["code"])
+        self.assertEqual(merged[1]["code_snippet"], "[300]")
+
+    def test_adjacent_lines_merge(self):
+        self.assertEqual(len(merge([finding([50, 51]), finding([52])])), 1)
+
+    def test_different_types_do_not_merge(self):
+        merged = merge([finding([10]), finding([10], type="及时释放数据库资源")])
+        self.assertEqual(len(merged), 2)
+
+    def test_findings_without_lines_are_kept(self):
+        merged = merge([finding([]), finding([])])
+        self.assertEqual(len(merged), 2)
+
+    def test_chain_does_not_merge_into_one_group(self):
+        # 两两相接的一串漏洞不能连成覆盖大半个文件的一组
+        chain = [finding([10 * k, 10 * k + 10]) for k in range(1, 31)]
+        merged = merge(chain)
+        self.assertGreater(len(merged), 1)
+        for vulnerability in merged:
+            lines = parse_line_list(vulnerability["code_snippet"])
+            self.assertLessEqual(max(lines) - min(lines), VULN_MERGE_MAX_SPAN)
+            self.assertLessEqual(vulnerability.get("code", "").count("\n"), VULN_MERGE_MAX_WINDOW)
+
+    def test_first_occurrence_order(self):
+        merged = merge([finding([500]), finding([10]), finding([501], "高危")])
+        self.assertEqual([vulnerability["code_snippet"] for vulnerability in merged], ["[500, 501]", "[10]"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+import os
+from bisect import bisect_right
+
+from app.services.data_validation import get_line
+from app.services.output_parser import parse_line_list
+
+# 漏洞等级从高到低
+DANGER_RANK = {"高危": 3, "中危": 2, "低危": 1}
+# 合并后一组漏洞的行号跨度上限，超出时不再并入，避免相互衔接的漏洞连成一大片
+VULN_MERGE_MAX_SPAN = int(os.getenv("VULN_MERGE_MAX_SPAN", "40"))
+# 合并后代码窗口的行数上限
+VULN_MERGE_MAX_WINDOW = int(os.getenv("VULN_MERGE_MAX_WINDOW", "80"))
+
+
+def probability_value(vulnerability) -> int:
+    try:
+        return int(str(vulnerability.get("probability", "")).strip())
+    except ValueError:
+        return 0
+
+
+def line_runs(numbers):
+    """把行号拆成连续区间 [(起始行号, 结束行号)]"""
+    runs = []
+    for number in sorted(set(numbers)):
+        if runs and number == runs[-1][1] + 1:
+            runs[-1][1] = number
+        else:
+            runs.append([number, number])
+    return [tuple(run) for run in runs]
+
+
+class IntervalIndex:
+    """
+    同一类漏洞的行号区间索引
+
+    区间按起点排序，不同分组的区间可以重叠；记录最长区间的长度，查询时向左扫描的范围有界。
+    """
+
+    def __init__(self):
+        self._starts = []
+        self._intervals = []  # (起始行号, 结束行号, 分组)
+        self._max_length = 0
+
+    def add(self, lo: int, hi: int, group: int):
+        i = bisect_right(self._starts, lo)
+        self._starts.insert(i, lo)
+        self._intervals.insert(i, (lo, hi, group))
+        self._max_length = max(self._max_length, hi - lo)
+
+    def overlapping(self, lo: int, hi: int):
+        """
+        :return: 区间与 [lo, hi] 重叠或相邻的分组
+        """
+        groups = set()
+        j = bisect_right(self._starts, hi + 1)
+        floor = lo - 1 - self._max_length
+        while j > 0 and self._starts[j - 1] >= floor:
+            j -= 1
+            start, end, group = self._intervals[j]
+            if end >= lo - 1:
+                groups.add(group)
+        return groups
+
+
+def merge_vulnerabilities(vulnerabilities, numbered_lines, positions, line_count):
+    """
+    合并同一类型（一级标题、二级标题）且行号区间重叠或相邻的漏洞
+
+    只与组内已有漏洞的行号区间直接比较，合并不能让组的跨度超过 VULN_MERGE_MAX_SPAN
+    （或组内单条漏洞本身的跨度），相互衔接的漏洞不会连成覆盖大半个文件的一组。
+    合并后保留等级最高（其次概率最高）的一条作为描述，行号取并集，代码窗口取各自
+    get_line 窗口的并集，超过 VULN_MERGE_MAX_WINDOW 行时只取描述所用漏洞的窗口。
+    结果按每组第一次出现的顺序排列。
+
+    :param numbered_lines: 带行号的行序列，用于重新截取合并后的代码窗口
+    :param positions: 源文件行号 -> numbered_lines 中的位置（从 1 开始）
+    """
+    indexes = {}
+    groups = {}  # 分组 -> 漏洞列表，分组编号为该组第一条漏洞的下标
+    spans = {}  # 分组 -> (最小行号, 最大行号)
+    for i, vulnerability in enumerate(vulnerabilities):
+        numbers = parse_line_list(vulnerability.get("code_snippet", ""))
+        key = (vulnerability.get("category"), vulnerability.get("type") or vulnerability.get("defect_name"))
+        group = i
+        if numbers:
+            index = indexes.setdefault(key, IntervalIndex())
+            runs = line_runs(numbers)
+            lo, hi = runs[0][0], runs[-1][1]
+            candidates = set()
+            for run_lo, run_hi in runs:
+                candidates |= index.overlapping(run_lo, run_hi)
+            for candidate in sorted(candidates):
+                group_lo, group_hi = spans[candidate]
+                limit = max(VULN_MERGE_MAX_SPAN, group_hi - group_lo, hi - lo)
+                if max(hi, group_hi) - min(lo, group_lo) <= limit:
+                    group = candidate
+                    lo, hi = min(lo, group_lo), max(hi, group_hi)
+                    break
+            spans[group] = (lo, hi)
+            for run_lo, run_hi in runs:
+                index.add(run_lo, run_hi, group)
+        groups.setdefault(group, []).append(vulnerability)
+
+    merged = []
+    for group in sorted(groups):
+        members = groups[group]
+        if len(members) == 1:
+            merged.append(members[0])
+            continue
+        best = max(members, key=lambda item: (DANGER_RANK.get(item.get("danger_level"), 0), probability_value(item)))
+        numbers = set()
+        windows = []
+        best_window = None
+        for item in members:
+            item_numbers = parse_line_list(item.get("code_snippet", ""))
+            numbers.update(item_numbers)
+            rows = [positions[number] for number in item_numbers if number in positions]
+            if rows:
+                window = get_line(rows, line_count)
+                windows.append(window)
+                if item is best:
+                    best_window = window
+        vulnerability = dict(best)
+        vulnerability["code_snippet"] = str(sorted(numbers))
+        if windows:
+            start_line = min(start for start, _ in windows)
+            end_line = max(end for _, end in windows)
+            if end_line - start_line > VULN_MERGE_MAX_WINDOW:
+                start_line, end_line = best_window or windows[0]
+                end_line = min(end_line, start_line + VULN_MERGE_MAX_WINDOW)
+            vulnerability["code"] = ''.join(numbered_lines[start_line: end_line])
+        merged.append(vulnerability)
+    return merged
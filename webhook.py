@@ -1,6 +1,8 @@
+import asyncio
 import base64
 import os
-import re
+from collections import defaultdict
+from functools import partial
 
 import aio_pika
 import aiofiles
@@ -11,34 +13,52 @@ import hmac
 import hashlib
 import logging
 
-from sqlalchemy import select
 from starlette.responses import JSONResponse
 
-from app.models.database import async_get_db
-from app.models.models import GitConfig
+from app.services.config_cache import get_git_config
+from app.services.queue_publisher import build_task_message, publish_batch
+from app.services.blob_store import blob_store
+from app.services.delivery_dedup import delivery_dedup, delivery_key, commit_file_key, blob_audit_key
+from app.services.fair_scheduler import PRIORITY_DIFF, PRIORITY_FILE
+from app.services.diff_hunks import HunkBuilder, get_file_hunks, write_line_map
 
 router = APIRouter()
 logging.basicConfig(level=logging.INFO)
 
 # 配置各平台的 Secret
 
+# 单次推送内并发抓取的上限，以及整个进程内访问 git 平台的并发上限
+PUSH_FETCH_CONCURRENCY = int(os.getenv("PUSH_FETCH_CONCURRENCY", "8"))
+GLOBAL_FETCH_CONCURRENCY = int(os.getenv("GLOBAL_FETCH_CONCURRENCY", "32"))
+_global_fetch_semaphore = asyncio.Semaphore(GLOBAL_FETCH_CONCURRENCY)
 
-async def task_to_queue(user_id, git_type, issue_url, file_path, request, ACCESS_TOKEN, task_type: str = "webhook_tasks"):
+# 开启后 webhook 只做鉴权并投递推送任务，下载、落盘和入队交给 ingest_worker
+WEBHOOK_ASYNC_INGEST = os.getenv("WEBHOOK_ASYNC_INGEST", "0") == "1"
+PUSH_QUEUE = "push_events"
+
+
+class IncompletePushError(Exception):
+    """推送中有文件未能抓取或其任务未得到 broker 确认；已完成的部分已登记，重试时只处理其余部分"""
+
+
+async def task_to_queue(user_id, git_type, issue_url, file_path, state, ACCESS_TOKEN, task_type: str = "webhook_tasks"):
+    message = build_task_message(user_id, git_type, issue_url, file_path, ACCESS_TOKEN)
+    channel = state.channel
+    await channel.default_exchange.publish(
+        message,
+        routing_key=task_type,
+    )
+
+async def enqueue_push(state, job):
+    """将鉴权通过的推送事件投递到 push_events 队列，由 ingest_worker 异步处理"""
     message = aio_pika.Message(
-        body=json.dumps({
-            "user_id": user_id,
-            "git_type": git_type,
-            "issue_url": issue_url,
-            "file_path": file_path,
-            "access_token": ACCESS_TOKEN
-        }).encode(),
+        body=json.dumps(job).encode(),
         delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
         content_type="application/json"
     )
-    channel = request.app.state.channel
-    await channel.default_exchange.publish(
+    await state.channel.default_exchange.publish(
         message,
-        routing_key=task_type,
+        routing_key=PUSH_QUEUE,
     )
 
 async def async_write_text_to_file(user_id:str, file_id: str, content: str, encoding: str = "utf-8"):
@@ -58,158 +78,391 @@ async def async_write_text_to_file(user_id:str, file_id: str, content: str, enco
 
 
 
-def get_file_diff(diff):
-    pattern = r'^\+(.*)$'  # 注意：需要使用多行模式
-    added_lines = re.findall(pattern, diff, re.MULTILINE)
-    return '\n'.join(added_lines)
+class DiffSplitter:
+    """
+    逐行解析统一 diff 文本，按文件切分并在同一遍中提取变更区域
 
-async def get_file_diffs(diff_url, headers):
-    async with httpx.AsyncClient() as client:
-        response = await client.get(diff_url, headers=headers)
-    file_diffs = []
-    current_diff = []
-    for line in response.text.splitlines():
-        if line.startswith('diff --git') and current_diff != []:
-            file_diffs.append('\n'.join(current_diff))
-            current_diff = []
-        else:
-            current_diff.append(line)
-    file_diffs.append('\n'.join(current_diff))
-    return file_diffs
+    只保留当前文件的 hunk，内存占用以单个文件段为上限
+    """
+
+    def __init__(self):
+        self.path = None
+        self.hunks = HunkBuilder()
+        self.in_hunk = False
+
+    def feed(self, line: str):
+        """
+        输入一行 diff
+
+        :return: 遇到下一个文件头时返回上一个文件的 (路径, 变更内容, 行号列表)，否则返回 None
+        """
+        if line.startswith("diff --git "):
+            section = self.flush()
+            # diff --git a/path b/path，文件头中的 +++ 行会再覆盖一次
+            self.path = line.rsplit(" b/", 1)[-1]
+            return section
+        if not self.in_hunk:
+            if line.startswith("+++ b/"):
+                self.path = line[6:]
+            elif line.startswith("@@"):
+                self.in_hunk = True
+                self.hunks.feed(line)
+            return None
+        self.hunks.feed(line)
+        return None
+
+    def flush(self):
+        """结束当前文件段，没有新增行（删除、二进制文件等）时返回 None"""
+        section = None
+        if self.path and self.hunks.has_changes:
+            section = (self.path, *self.hunks.render())
+        self.path = None
+        self.hunks = HunkBuilder()
+        self.in_hunk = False
+        return section
+
+
+async def iter_file_diffs(client, diff_url, headers):
+    """流式下载提交 diff，逐个产出 (文件路径, 变更内容, 行号列表)"""
+    splitter = DiffSplitter()
+    async with client.stream("GET", diff_url, headers=headers) as response:
+        async for line in response.aiter_lines():
+            section = splitter.feed(line.rstrip("\r\n"))
+            if section:
+                yield section
+    section = splitter.flush()
+    if section:
+        yield section
+
+
+class PushFileWriter:
+    """
+    并发写入一次推送中的文件
+
+    同一路径可能被多个提交写入，这里以提交顺序靠后的内容为准，
+    最终落盘结果与逐个串行处理时一致
+    """
 
-async def file_process(request, user_id, file, git_type, ACCESS_TOKEN,  diff_url, issue_url, head):
-    async with httpx.AsyncClient() as client:
-        response = await client.get(diff_url, headers=head)
-    content_b64 = response.json()["content"]
-    diff_content = base64.b64decode(content_b64).decode("utf-8")
-    await async_write_text_to_file(user_id, file, diff_content)
-    await task_to_queue(user_id, git_type, issue_url, file, request, ACCESS_TOKEN)
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self._locks = defaultdict(asyncio.Lock)
+        self._orders = {}
 
+    async def write(self, order: int, file_id: str, content: str, line_numbers=None):
+        """
+        :param line_numbers: diff 模式下每行对应的新文件行号，整文件写入时为 None
+        """
+        async with self._locks[file_id]:
+            if self._orders.get(file_id, -1) > order:
+                return
+            await async_write_text_to_file(self.user_id, file_id, content)
+            await write_line_map(self.user_id, file_id, line_numbers)
+            self._orders[file_id] = order
 
-async def process_gitlab(request, user_id, ACCESS_TOKEN, project_id, mode, commits, ref):
+
+async def run_bounded(jobs, limit: int = PUSH_FETCH_CONCURRENCY):
+    """
+    在单次推送和全局两级并发上限内执行任务
+
+    :param jobs: 无参协程函数列表
+    :param limit: 单次推送的并发上限
+    :return: 与 jobs 顺序一致的结果列表，失败的任务对应 None
+    """
+    push_semaphore = asyncio.Semaphore(limit)
+
+    async def run(job):
+        async with push_semaphore, _global_fetch_semaphore:
+            try:
+                return await job()
+            except Exception as e:
+                logging.error(f"push job error: {e}")
+                return None
+
+    return await asyncio.gather(*(run(job) for job in jobs))
+
+
+async def enqueue_results(state, user_id, git_type, ACCESS_TOKEN, results, task_type: str = "webhook_tasks", priority=None):
+    """
+    按提交、文件的原始顺序批量发布任务，保证入队顺序确定
+
+    :return: 与 results 顺序一致的列表，抓取成功且其任务全部得到确认时为 True，
+             抓取失败为 None，有任务发布失败为 False
+    """
+    tasks = [task for result in results for task in result or []]
+    messages = [
+        build_task_message(user_id, git_type, issue_url, file_id, ACCESS_TOKEN, priority)
+        for issue_url, file_id, blob_sha in tasks
+    ]
+    confirms = iter(await publish_batch(state.channel, messages, task_type))
+    published = []
+    audited = []
+    for result in results:
+        if result is None:
+            published.append(None)
+            continue
+        ok = True
+        for issue_url, file_id, blob_sha in result:
+            confirm = next(confirms)
+            if confirm is not True:
+                ok = False
+                logging.error(f"task publish failed {file_id}: {confirm}")
+            elif blob_sha:
+                audited.append(blob_audit_key(user_id, blob_sha, file_id))
+        published.append(ok)
+    # 已确认的 (blob, 路径) 登记到数据库，重启后与其它 worker 同样跳过
+    await delivery_dedup.record_many(audited, "blob")
+    return published
+
+
+async def run_push(state, user_id, git_type, ACCESS_TOKEN, mode, jobs):
+    """
+    执行一次推送的全部抓取任务并发布审计任务
+
+    :param mode: "1" 为 diff 模式，其任务优先于整文件审计
+    :param jobs: (去重键, 无参协程函数) 列表，已处理过的 (仓库, 提交, 路径) 会被跳过
+    :raises IncompletePushError: 有文件抓取失败或任务发布失败，已完成的键仍会登记
+    """
+    seen = await delivery_dedup.seen_many([key for key, job in jobs], "commit_file")
+    pending = [(key, job) for (key, job), duplicate in zip(jobs, seen) if not duplicate]
+    if len(pending) < len(jobs):
+        logging.info(f"skip {len(jobs) - len(pending)} already processed commit files for {user_id}")
+    results = await run_bounded([job for key, job in pending])
+    priority = PRIORITY_DIFF if mode == "1" else PRIORITY_FILE
+    published = await enqueue_results(state, user_id, git_type, ACCESS_TOKEN, results, priority=priority)
+    await delivery_dedup.record_many([key for (key, job), ok in zip(pending, published) if ok], "commit_file")
+    failed_fetches = published.count(None)
+    failed_publishes = published.count(False)
+    if failed_fetches or failed_publishes:
+        raise IncompletePushError(
+            f"push of {user_id}: {failed_fetches} fetches failed, {failed_publishes} publishes failed"
+        )
+
+
+def commit_files(commit):
+    modified_files = commit.get("modified") or []
+    added_files = commit.get("added") or []
+    return modified_files + added_files
+
+
+async def fetch_contents_file(client, writer, order, diff_url, head, file, issue_url):
+    """
+    通过 contents 接口下载完整文件（base64）并写入磁盘
+
+    contents 接口的 blob SHA 与内容一同返回，同一路径上已审计过的 blob 只能跳过落盘和入队
+    """
+    response = await client.get(diff_url, headers=head)
+    data = response.json()
+    blob_sha = data.get("sha")
+    if blob_sha and await blob_store.was_audited(writer.user_id, blob_sha, file):
+        return []
+    diff_content = base64.b64decode(data["content"]).decode("utf-8")
+    await writer.write(order, file, diff_content)
+    if blob_sha:
+        await blob_store.put(blob_sha, diff_content)
+    return [(issue_url, file, blob_sha)]
+
+
+async def fetch_raw_file(client, writer, order, meta_url, diff_url, headers, file, issue_url):
+    """
+    通过 raw 接口下载完整文件并写入磁盘
+
+    先用 HEAD 请求取得 blob SHA：同一路径上已审计过的 blob 直接跳过，缓存中已有的 blob 不再下载
+    """
+    head = await client.head(meta_url, headers=headers)
+    blob_sha = head.headers.get("x-gitlab-blob-id")
+    if blob_sha:
+        if await blob_store.was_audited(writer.user_id, blob_sha, file, downloaded=False):
+            return []
+        content = await blob_store.get(blob_sha)
+        if content is not None:
+            await writer.write(order, file, content)
+            return [(issue_url, file, blob_sha)]
+    response = await client.get(diff_url, headers=headers)
+    await writer.write(order, file, response.text)
+    if blob_sha:
+        await blob_store.put(blob_sha, response.text)
+    return [(issue_url, file, blob_sha)]
+
+
+async def fetch_commit_diffs(client, writer, order, diff_url, headers, issue_url):
+    """流式下载整个提交的 diff，每解析完一个文件就写入磁盘"""
+    tasks = []
+    async for new_path, diff_content, line_numbers in iter_file_diffs(client, diff_url, headers):
+        await writer.write(order, new_path, diff_content, line_numbers)
+        tasks.append((issue_url, new_path, None))
+    return tasks
+
+
+async def fetch_gitlab_commit_diff(client, writer, order, diff_url, headers, issue_url):
+    """下载 GitLab 提交的逐文件 diff 并写入磁盘"""
+    response = await client.get(diff_url, headers=headers)
+    tasks = []
+    for file_diff in response.json():
+        new_path = file_diff['new_path']
+        diff_content, line_numbers = get_file_hunks(file_diff["diff"])
+        if not line_numbers:
+            continue
+        await writer.write(order, new_path, diff_content, line_numbers)
+        tasks.append((issue_url, new_path, None))
+    return tasks
+
+
+async def process_gitlab(state, user_id, ACCESS_TOKEN, project_id, mode, commits, ref):
     headers = {
         "PRIVATE-TOKEN": ACCESS_TOKEN,
     }
     git_type = "gitlab"
-    if mode == "1":
-        for commit in commits:
-            path_parts = commit["url"].split("/")
-            gitlab_url = f"{path_parts[0]}//{path_parts[2]}"
-            sha = commit["id"]
-            if mode == "1":
-                diff_url = f"{gitlab_url}/api/v4/projects/{project_id}/repository/commits/{sha}/diff"
-                async with httpx.AsyncClient() as client:
-                    response = await client.get(diff_url, headers=headers)
-                    for file_diff in response.json():
-                        diff = file_diff["diff"]
-                        new_path = file_diff['new_path']
-                        diff_content = get_file_diff(diff)
-                        await async_write_text_to_file(user_id, new_path, diff_content)
-                        comments_url = f"{gitlab_url}/api/v4/projects/{project_id}/repository/commits/{sha}/comments"
-                        await task_to_queue(user_id, git_type, comments_url, new_path, request, ACCESS_TOKEN)
-            elif mode == "0":
-                modified_files = commit.get("modified") or []
-                added_files = commit.get("added") or []
-                all_files = modified_files + added_files
-                if not all_files:
-                    continue
-                for file in all_files:
-                    diff_url = f"{gitlab_url}/api/v4/projects/{project_id}/repository/files/{file}/raw?ref={ref}"
-                    async with httpx.AsyncClient() as client:
-                        response = await client.get(diff_url, headers=headers)
-                    diff_content = response.text
-                    await async_write_text_to_file(user_id, file, diff_content)
-                    commit_url = f"{gitlab_url}/api/v4/projects/{project_id}/repository/commits/{commit["id"]}/comments"
-                    await task_to_queue(user_id, git_type, commit_url, file, request, ACCESS_TOKEN)
-
-async def process_gitee(request, user_id, ACCESS_TOKEN, mode, commits, ref):
+    client = state.http_client
+    writer = PushFileWriter(user_id)
+    jobs = []
+    for commit in commits:
+        path_parts = commit["url"].split("/")
+        gitlab_url = f"{path_parts[0]}//{path_parts[2]}"
+        sha = commit["id"]
+        comments_url = f"{gitlab_url}/api/v4/projects/{project_id}/repository/commits/{sha}/comments"
+        if mode == "1":
+            diff_url = f"{gitlab_url}/api/v4/projects/{project_id}/repository/commits/{sha}/diff"
+            jobs.append((commit_file_key(user_id, commit), partial(fetch_gitlab_commit_diff, client, writer, len(jobs), diff_url, headers, comments_url)))
+        elif mode == "0":
+            for file in commit_files(commit):
+                meta_url = f"{gitlab_url}/api/v4/projects/{project_id}/repository/files/{file}?ref={ref}"
+                diff_url = f"{gitlab_url}/api/v4/projects/{project_id}/repository/files/{file}/raw?ref={ref}"
+                jobs.append((commit_file_key(user_id, commit, file), partial(fetch_raw_file, client, writer, len(jobs), meta_url, diff_url, headers, file, comments_url)))
+    await run_push(state, user_id, git_type, ACCESS_TOKEN, mode, jobs)
+
+async def process_gitee(state, user_id, ACCESS_TOKEN, mode, commits, ref):
     git_type = "gitee"
     headers = {
                 "Authorization": f"token {ACCESS_TOKEN}",
                 "Accept": "application/vnd.gitee.v1.diff"
             }
+    client = state.http_client
+    writer = PushFileWriter(user_id)
+    jobs = []
     for commit in commits:
         url = commit["url"].replace("/commit/", "/commits/")
         path_parts = url.split("/", 3)
         gitlab_url = f"{path_parts[0]}//{path_parts[2]}"
         if mode == "1":
             diff_url = f"{gitlab_url}/api/v5/repos/" + path_parts[3]
-            sha = commit["id"]
-            file_diffs = await get_file_diffs(diff_url, headers)
-            for file_diff in file_diffs:
-                diff_content = get_file_diff(file_diff)
-                await async_write_text_to_file(user_id, sha, diff_content)
-                commit_url = f"{path_parts[0]}//{path_parts[2]}/api/v5/repos/{path_parts[3]}/comments"
-                await task_to_queue(user_id, git_type, commit_url, sha, request, ACCESS_TOKEN)
+            commit_url = f"{path_parts[0]}//{path_parts[2]}/api/v5/repos/{path_parts[3]}/comments"
+            jobs.append((commit_file_key(user_id, commit), partial(fetch_commit_diffs, client, writer, len(jobs), diff_url, headers, commit_url)))
         elif mode == "0":
-            modified_files = commit.get("modified") or []
-            added_files = commit.get("added") or []
-            all_files = modified_files + added_files
-            if not all_files:
-                continue
-            for file in all_files:
-                path_parts = url.split("/")
-                diff_url = f"{gitlab_url}/api/v5/repos/{path_parts[3]}/{path_parts[4]}/contents/{file}?ref={ref}"
-                commit_url = f"{path_parts[0]}//{path_parts[2]}/api/v5/repos/{path_parts[3]}/{path_parts[4]}/commits/{commit["id"]}/comments"
-                await file_process(request, user_id, file, git_type, ACCESS_TOKEN, diff_url, commit_url, headers)
-
-async def process_gitea(request, url, user_id, ACCESS_TOKEN, mode, commits, ref):
+            repo_parts = url.split("/")
+            for file in commit_files(commit):
+                diff_url = f"{gitlab_url}/api/v5/repos/{repo_parts[3]}/{repo_parts[4]}/contents/{file}?ref={ref}"
+                commit_url = f"{repo_parts[0]}//{repo_parts[2]}/api/v5/repos/{repo_parts[3]}/{repo_parts[4]}/commits/{commit['id']}/comments"
+                jobs.append((commit_file_key(user_id, commit, file), partial(fetch_contents_file, client, writer, len(jobs), diff_url, headers, file, commit_url)))
+    await run_push(state, user_id, git_type, ACCESS_TOKEN, mode, jobs)
+
+async def process_gitea(state, url, user_id, ACCESS_TOKEN, mode, commits, ref):
     git_type = "gitea"
     head = {
         "Authorization": f"token {ACCESS_TOKEN}",
         "Accept": "application/vnd.gitee.v1.diff"
     }
+    client = state.http_client
+    writer = PushFileWriter(user_id)
+    issue_url = f"{url}/issues"
+    jobs = []
     for commit in commits:
         sha = commit["id"]
         if mode == "1":
             diff_url = url + f"/git/commits/{sha}.diff"
-            file_diffs = await get_file_diffs(diff_url, head)
-            for file_diff in file_diffs:
-                diff_content = get_file_diff(file_diff)
-                await async_write_text_to_file(user_id, sha, diff_content)
-                issue_url = f"{url}/issues"
-                await task_to_queue(user_id, git_type, issue_url, sha, request, ACCESS_TOKEN)
+            jobs.append((commit_file_key(user_id, commit), partial(fetch_commit_diffs, client, writer, len(jobs), diff_url, head, issue_url)))
         elif mode == "0":
-            modified_files = commit.get("modified") or []
-            added_files = commit.get("added") or []
-            all_files = modified_files + added_files
-            if not all_files:
-                continue
-            for file in all_files:
+            for file in commit_files(commit):
                 diff_url = f"{url}/contents/{file}?ref={ref}"
-                issue_url = f"{url}/issues"
-                await file_process(request, user_id, file, git_type, ACCESS_TOKEN, diff_url, issue_url, head)
+                jobs.append((commit_file_key(user_id, commit, file), partial(fetch_contents_file, client, writer, len(jobs), diff_url, head, file, issue_url)))
+    await run_push(state, user_id, git_type, ACCESS_TOKEN, mode, jobs)
 
-async def process_gitub(request, commits_url, contents_url, user_id, ACCESS_TOKEN, mode, commits, ref):
+async def process_gitub(state, commits_url, contents_url, user_id, ACCESS_TOKEN, mode, commits, ref):
     git_type = "github"
     headers = {
             "Authorization": f"token {ACCESS_TOKEN}",
             "Accept": "application/vnd.github.diff"
         }
+    client = state.http_client
+    writer = PushFileWriter(user_id)
+    jobs = []
     for commit in commits:
         sha = commit["id"]
         result_url = commits_url.replace("{/sha}", f"/{sha}")
+        issue_url = f"{result_url}/comments"
         if mode == "1":
-            file_diffs = await get_file_diffs(result_url, headers)
-            for file_diff in file_diffs:
-                diff_content = get_file_diff(file_diff)
-                await async_write_text_to_file(user_id, sha, diff_content)
-                issue_url = f"{result_url}/comments"
-                await task_to_queue(user_id, git_type, issue_url, sha, request, ACCESS_TOKEN)
-
+            jobs.append((commit_file_key(user_id, commit), partial(fetch_commit_diffs, client, writer, len(jobs), result_url, headers, issue_url)))
         elif mode == "0":
-            modified_files = commit.get("modified") or []
-            added_files = commit.get("added") or []
-            all_files = modified_files + added_files
-            for file in all_files:
-                contents_url = contents_url.replace("{+path}", f"/{file}") + f"?ref={ref}"
-                async with httpx.AsyncClient() as client:
-                    response = await client.get(contents_url, headers=headers)
-                content_b64 = response.json()["content"]
-                diff_content = base64.b64decode(content_b64).decode("utf-8")
-                await async_write_text_to_file(user_id, file, diff_content)
-                issue_url = f"{result_url}/comments"
-                await task_to_queue(user_id, git_type, issue_url, file, request, ACCESS_TOKEN)
+            for file in commit_files(commit):
+                file_url = contents_url.replace("{+path}", f"/{file}") + f"?ref={ref}"
+                jobs.append((commit_file_key(user_id, commit, file), partial(fetch_contents_file, client, writer, len(jobs), file_url, headers, file, issue_url)))
+    await run_push(state, user_id, git_type, ACCESS_TOKEN, mode, jobs)
+
+def compact_commits(commits):
+    """只保留拉取文件需要的提交字段，减小推送任务消息体积"""
+    return [
+        {
+            "id": commit["id"],
+            "url": commit["url"],
+            "modified": commit.get("modified") or [],
+            "added": commit.get("added") or [],
+        }
+        for commit in commits
+    ]
+
+async def ingest_push(state, job):
+    """
+    执行一次推送的下载、落盘与入队
+
+    :param state: 提供 channel 与 http_client 的对象，webhook 中为 app.state
+    :param job: webhook 鉴权后生成的推送任务
+    """
+    platform = job["platform"]
+    user_id = job["user_id"]
+    ACCESS_TOKEN = job["access_token"]
+    mode = job["mode"]
+    commits = job["commits"]
+    ref = job["ref"]
+    if platform == "gitlab":
+        await process_gitlab(state, user_id, ACCESS_TOKEN, job["project_id"], mode, commits, ref)
+    elif platform == "gitee":
+        await process_gitee(state, user_id, ACCESS_TOKEN, mode, commits, ref)
+    elif platform == "gitea":
+        await process_gitea(state, job["url"], user_id, ACCESS_TOKEN, mode, commits, ref)
+    elif platform == "github":
+        await process_gitub(state, job["commits_url"], job["contents_url"], user_id, ACCESS_TOKEN, mode, commits, ref)
+    else:
+        logging.warning(f"unknown push platform: {platform}")
+
+async def handle_push(request, job, name):
+    """
+    同步模式下直接处理推送；异步模式下只投递任务并立即返回 202
+
+    平台重试的同一投递 ID 直接返回，处理失败时撤销登记以便平台重试
+    """
+    key = delivery_key(job["user_id"], request.headers)
+    if key and not await delivery_dedup.claim(key):
+        return JSONResponse(
+            status_code=status.HTTP_200_OK,
+            content={"detail": f"{name} duplicate delivery ignored"}
+        )
+    try:
+        if WEBHOOK_ASYNC_INGEST:
+            await enqueue_push(request.app.state, job)
+        else:
+            await ingest_push(request.app.state, job)
+    except Exception:
+        if key:
+            await delivery_dedup.release(key)
+        raise
+    if WEBHOOK_ASYNC_INGEST:
+        return JSONResponse(
+            status_code=status.HTTP_202_ACCEPTED,
+            content={"detail": f"{name} push accepted"}
+        )
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={"detail": f"{name} push processed"}
+    )
 
 
 @router.post("/{id}")
@@ -225,18 +478,17 @@ async def webhook(request: Request, id: str):
             status_code=status.HTTP_400_BAD_REQUEST,
             content={"detail": "Invalid JSON in request body"}
         )
-    async with async_get_db() as db:
-        result = await db.execute(select(GitConfig).where(GitConfig.user_id == id))
-        gitconfig = result.scalars().first()
-        if not gitconfig:
-            return JSONResponse(
-                status_code=status.HTTP_404_NOT_FOUND,
-                content={"detail": "Git config not found"}
-            )
-        password = gitconfig.password_hash
-        mode = "1" if gitconfig.mode else "0"
-        ACCESS_TOKEN = gitconfig.access_token
-        # 正常逻辑继续处理...
+    gitconfig = await get_git_config(id)
+    if not gitconfig:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"detail": "Git config not found"}
+        )
+    password = gitconfig["password"]
+    mode = gitconfig["mode"]
+    ACCESS_TOKEN = gitconfig["access_token"]
+    # 正常逻辑继续处理...
+    push_job = {"user_id": id, "access_token": ACCESS_TOKEN, "mode": mode}
     try:
         if "x-gitlab-event" in headers:
             if headers.get("x-gitlab-token") != password:
@@ -246,16 +498,14 @@ async def webhook(request: Request, id: str):
             commits = body.get("commits", [])
             ref = body.get("ref", "")
             if event_type == "Push Hook":
-                await process_gitlab(request, id, ACCESS_TOKEN, project_id, mode, commits, ref)
+                job = {**push_job, "platform": "gitlab", "project_id": project_id,
+                       "commits": compact_commits(commits), "ref": ref}
+                return await handle_push(request, job, "GitLab")
             else:
                 return JSONResponse(
                     status_code=status.HTTP_403_FORBIDDEN,
                     content={"detail": "目前只支持push事件"}
                 )
-            return JSONResponse(
-                status_code=status.HTTP_200_OK,
-                content={"detail": "GitLab push processed"}
-            )
 
         elif "x-gitee-event" in headers:
             if headers.get("x-gitee-token") != password:
@@ -264,16 +514,14 @@ async def webhook(request: Request, id: str):
             if event_type == "Push Hook":
                 commits = body.get("commits", [])
                 ref = body.get("ref", "")
-                await process_gitee(request, id, ACCESS_TOKEN, mode, commits, ref)
+                job = {**push_job, "platform": "gitee",
+                       "commits": compact_commits(commits), "ref": ref}
+                return await handle_push(request, job, "Gitee")
             else:
                 return JSONResponse(
                     status_code=status.HTTP_403_FORBIDDEN,
                     content={"detail": "目前只支持push事件"}
                 )
-            return JSONResponse(
-                status_code=status.HTTP_200_OK,
-                content={"detail": "Gitee push processed"}
-            )
 
         #
         elif "x-gitea-event" in headers:
@@ -289,17 +537,15 @@ async def webhook(request: Request, id: str):
                 url = body["repository"]["url"]
                 commits = body.get("commits", [])
                 ref = body.get("ref", "")
-                await process_gitea(request, url, id, ACCESS_TOKEN, mode, commits, ref)
+                job = {**push_job, "platform": "gitea", "url": url,
+                       "commits": compact_commits(commits), "ref": ref}
+                return await handle_push(request, job, "GitLea")
 
             else:
                 return JSONResponse(
                     status_code=status.HTTP_403_FORBIDDEN,
                     content={"detail": "目前只支持push事件"}
                 )
-            return JSONResponse(
-                status_code=status.HTTP_200_OK,
-                content={"detail": "GitLea push processed"}
-            )
         elif "x-github-event" in headers:
             signature = headers.get("x-hub-signature-256", "")
             hmac_obj = hmac.new("123".encode(), msg=body_bytes, digestmod=hashlib.sha256).hexdigest()
@@ -314,17 +560,15 @@ async def webhook(request: Request, id: str):
                 contents_url = body["repository"]["contents_url"]
                 commits = body.get("commits", [])
                 ref = body.get("ref", "")
-                await process_gitub(request, commits_url, contents_url, id, ACCESS_TOKEN, mode, commits, ref)
+                job = {**push_job, "platform": "github", "commits_url": commits_url,
+                       "contents_url": contents_url, "commits": compact_commits(commits), "ref": ref}
+                return await handle_push(request, job, "GitLub")
 
             else:
                 return JSONResponse(
                     status_code=status.HTTP_403_FORBIDDEN,
                     content={"detail": "目前只支持push事件"}
                 )
-            return JSONResponse(
-                status_code=status.HTTP_200_OK,
-                content={"detail": "GitLub push processed"}
-            )
 
         else:
             return JSONResponse(